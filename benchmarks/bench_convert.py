@@ -0,0 +1,83 @@
+"""
+Measure PDF rasterization throughput, in pages per second, for 1 to N parallel
+poppler processes.
+
+Usage:
+    python benchmarks/bench_convert.py [--pdf FILE] [--pages 64] [--dpi 150]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import django
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "docforge.settings")
+
+
+def build_pdf(source, pages, path):
+    """
+    Write a PDF with ``pages`` pages by repeating the pages of ``source``.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(source)
+    writer = PdfWriter()
+    for number in range(pages):
+        writer.add_page(reader.pages[number % len(reader.pages)])
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--pdf", default=ROOT_DIR / "test" / "test_data" / "test_document.pdf"
+    )
+    parser.add_argument("--pages", type=int, default=64)
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--max-workers", type=int, default=len(os.sched_getaffinity(0)))
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp()
+    os.environ["DOCFORGE_MEDIA_ROOT"] = media_root
+    django.setup()
+
+    from docengine.conversion import render_page_range
+
+    pdf_path = Path(media_root) / "bench.pdf"
+    build_pdf(args.pdf, args.pages, pdf_path)
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(f"{'workers':>8} {'seconds':>8} {'pages/s':>8} {'speedup':>8}")
+    try:
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            documents = render_page_range(
+                str(pdf_path), 1, args.pages, dpi=args.dpi, workers=workers
+            )
+            elapsed = time.perf_counter() - start
+            for document in documents:
+                document.file.delete(save=False)
+
+            rate = args.pages / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {elapsed:>8.2f} {rate:>8.1f} {rate / baseline:>7.2f}x")
+    finally:
+        shutil.rmtree(media_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare the time to write, look up and list document files in a flat documents
+directory and in the sharded layout, documents/ab/cd/<hash>.
+
+Usage:
+    python benchmarks/bench_layout.py [--files 1000000] [--lookups 10000] [--dir DIR]
+
+Creating a million files takes a few minutes and about as many inodes. Run it on
+the filesystem of the media directory to measure the one used in production.
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+
+def flat_name(filename):
+    return f"documents/{filename}"
+
+
+def sharded_name(filename):
+    from docengine.storage import document_upload_to
+
+    return document_upload_to(None, filename)
+
+
+def write_files(root, names):
+    """
+    Create empty files at the given names, with their directories.
+    """
+    directories = set()
+    for name in names:
+        directory = os.path.dirname(name)
+        if directory not in directories:
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+            directories.add(directory)
+        with open(os.path.join(root, name), "wb"):
+            pass
+
+
+def lookup_files(root, names):
+    for name in names:
+        os.stat(os.path.join(root, name))
+
+
+def list_directory(root, name):
+    with os.scandir(os.path.join(root, os.path.dirname(name))) as entries:
+        return sum(1 for _ in entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--dir", help="Directory to create the files in.")
+    args = parser.parse_args()
+
+    filenames = [
+        f"{hashlib.sha256(str(number).encode()).hexdigest()}.jpg"
+        for number in range(args.files)
+    ]
+    lookups = random.sample(filenames, min(args.lookups, args.files))
+
+    print(f"{args.files} files, {len(lookups)} lookups")
+    print(
+        f"{'layout':>8} {'write/s':>10} {'lookup us':>10} {'list s':>8} {'entries':>8}"
+    )
+    for layout, get_name in [("flat", flat_name), ("sharded", sharded_name)]:
+        root = tempfile.mkdtemp(dir=args.dir)
+        try:
+            names = [get_name(filename) for filename in filenames]
+            start = time.perf_counter()
+            write_files(root, names)
+            write_rate = len(names) / (time.perf_counter() - start)
+
+            lookup_names = [get_name(filename) for filename in lookups]
+            start = time.perf_counter()
+            lookup_files(root, lookup_names)
+            lookup_time = (time.perf_counter() - start) / len(lookup_names) * 1e6
+
+            start = time.perf_counter()
+            entries = list_directory(root, names[0])
+            list_time = time.perf_counter() - start
+
+            print(
+                f"{layout:>8} {write_rate:>10.0f} {lookup_time:>10.1f} "
+                f"{list_time:>8.3f} {entries:>8}"
+            )
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
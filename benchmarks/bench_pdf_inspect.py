@@ -0,0 +1,103 @@
+"""
+Compare the time and memory to read the page count and page dimensions of a
+large PDF, reading the whole file into memory and building every pypdf page
+(before), and walking the page tree of the open file (after).
+
+Usage:
+    python benchmarks/bench_pdf_inspect.py [--pages 1000] [--repeat 5]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+from pypdf import PdfReader, PdfWriter
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from docengine.metadata import read_pdf_metadata  # noqa: E402
+
+TEST_PDF = ROOT_DIR / "test" / "test_data" / "test_document.pdf"
+
+
+def make_pdf(path, pages):
+    """
+    Write a PDF of ``pages`` pages, copied from the test document.
+    """
+    source = PdfReader(TEST_PDF)
+    writer = PdfWriter()
+    for number in range(pages):
+        writer.add_page(source.pages[number % len(source.pages)])
+    with open(path, "wb") as output:
+        writer.write(output)
+
+
+def inspect_in_memory(path):
+    """
+    The previous inspection: the file is read into memory and a page object is
+    built for every page.
+    """
+    with open(path, "rb") as file:
+        pdf_reader = PdfReader(BytesIO(file.read()))
+        return {
+            "num_pages": len(pdf_reader.pages),
+            "page_dimensions": [
+                {
+                    "width": float(page.mediabox.width),
+                    "height": float(page.mediabox.height),
+                }
+                for page in pdf_reader.pages
+            ],
+        }
+
+
+def inspect_page_tree(path):
+    with open(path, "rb") as file:
+        return read_pdf_metadata(file)
+
+
+def measure(inspect, path, repeat):
+    """
+    Return the best time in seconds and the peak memory in bytes of ``inspect``.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        inspect(path)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    inspect(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "document.pdf"
+        make_pdf(path, args.pages)
+        size = path.stat().st_size
+
+        print(f"{args.pages} pages, {size / 1024:.0f} KiB")
+        print(f"{'inspection':>12} {'time ms':>10} {'peak KiB':>10}")
+        for name, inspect in [
+            ("in memory", inspect_in_memory),
+            ("page tree", inspect_page_tree),
+        ]:
+            elapsed, peak = measure(inspect, path, args.repeat)
+            print(f"{name:>12} {elapsed * 1000:>10.1f} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare the latency and output size of the image rotation paths for right-angle
+rotations: resampling rotate(), lossless transpose(), and EXIF orientation only.
+
+Usage:
+    python benchmarks/bench_rotate.py [--size 4000x3000] [--repeat 5]
+"""
+
+import argparse
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+
+def make_jpeg(width, height):
+    """
+    Return a JPEG photo-like test image: a gradient with noise on top.
+    """
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 64)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(0)))
+    image_io = BytesIO()
+    image.save(image_io, format="JPEG", quality=90)
+    return image_io.getvalue()
+
+
+def rotate_resample(data, angle):
+    """
+    The rotation used before right angles were special-cased.
+    """
+    image = Image.open(BytesIO(data))
+    rotated_image = image.rotate(angle, expand=True)
+    image_io = BytesIO()
+    rotated_image.save(image_io, format=image.format)
+    return image_io.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--angle", type=int, default=90)
+    args = parser.parse_args()
+
+    from docengine.imaging import rotate_image
+
+    width, height = (int(value) for value in args.size.split("x"))
+    data = make_jpeg(width, height)
+    paths = {
+        "rotate": lambda: rotate_resample(data, args.angle),
+        "transpose": lambda: rotate_image(BytesIO(data), args.angle)[0],
+        "exif": lambda: rotate_image(BytesIO(data), args.angle, exif_orientation=True)[
+            0
+        ],
+    }
+
+    print(f"Original: {width}x{height} JPEG, {len(data) / 1024:.0f} KiB")
+    print(f"{'path':>10} {'ms':>8} {'KiB':>8}")
+    for name, rotate in paths.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            output = rotate()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{name:>10} {elapsed * 1000:>8.1f} {len(output) / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
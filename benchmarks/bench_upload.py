@@ -0,0 +1,81 @@
+"""
+Measure batch upload throughput, in files per second, for 1 to N threads
+decoding, validating and storing the files.
+
+Usage:
+    python benchmarks/bench_upload.py [--files 200] [--size 1600x1200]
+"""
+
+import argparse
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import django
+from PIL import Image
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "docforge.settings")
+
+
+def make_items(count, width, height):
+    """
+    Return ``count`` upload items with distinct Base64 JPEG images.
+    """
+    items = []
+    for number in range(count):
+        image = Image.effect_noise((width, height), 32 + number % 64).convert("RGB")
+        image_io = BytesIO()
+        image.save(image_io, format="JPEG", quality=85)
+        encoded = base64.b64encode(image_io.getvalue()).decode()
+        items.append({"file": f"data:image/jpeg;base64,{encoded}"})
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size", default="1600x1200")
+    parser.add_argument("--max-workers", type=int, default=len(os.sched_getaffinity(0)))
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp()
+    os.environ["DOCFORGE_MEDIA_ROOT"] = media_root
+    django.setup()
+
+    from docengine.uploads import prepare_uploads
+
+    width, height = (int(value) for value in args.size.split("x"))
+    items = make_items(args.files, width, height)
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= args.max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != args.max_workers:
+        worker_counts.append(args.max_workers)
+
+    print(f"{'workers':>8} {'seconds':>8} {'files/s':>8} {'speedup':>8}")
+    try:
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            results = prepare_uploads(items, workers=workers)
+            elapsed = time.perf_counter() - start
+            for document, _ in results:
+                document.file.delete(save=False)
+
+            rate = args.files / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {elapsed:>8.2f} {rate:>8.1f} {rate / baseline:>7.2f}x")
+    finally:
+        shutil.rmtree(media_root)
+
+
+if __name__ == "__main__":
+    main()
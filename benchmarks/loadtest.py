@@ -0,0 +1,135 @@
+"""
+Measure how many requests a running server answers while slow clients are
+uploading, to compare the WSGI and ASGI deployments.
+
+Slow clients send a Base64 upload body a few bytes at a time, as clients on a bad
+connection do. Meanwhile, fast clients request the images list in a loop, and the
+throughput and latency of these requests are reported.
+
+Run it against the application server directly, not through nginx, which buffers
+request bodies before passing them on. For example, with the sync endpoints under
+gunicorn's sync workers, then with the async endpoints under uvicorn workers:
+
+    gunicorn docforge.wsgi:application --bind :8000 --workers 8
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --api /api/
+
+    gunicorn docforge.asgi:application -k uvicorn_worker.UvicornWorker \\
+        --bind :8000 --workers 8
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --api /api/async/
+"""
+
+import argparse
+import asyncio
+import base64
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def request(host, port, method, path, body=b"", trickle=None):
+    """
+    Send an HTTP/1.1 request and return the response status code. With
+    ``trickle`` (chunk size, delay), the body is sent in small chunks.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode())
+        if trickle:
+            chunk_size, delay = trickle
+            for start in range(0, len(body), chunk_size):
+                writer.write(body[start : start + chunk_size])
+                await writer.drain()
+                await asyncio.sleep(delay)
+        else:
+            writer.write(body)
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def slow_client(host, port, path, body, trickle, deadline):
+    while time.monotonic() < deadline:
+        try:
+            await request(host, port, "POST", path, body, trickle)
+        except (OSError, IndexError, ValueError):
+            await asyncio.sleep(0.1)
+
+
+async def fast_client(host, port, path, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            status = await request(host, port, "GET", path)
+        except (OSError, IndexError, ValueError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(status)
+
+
+def make_upload_body(size):
+    """
+    Return a JSON upload body of about ``size`` bytes. The data is a valid PNG
+    header padded with zeros, enough to keep the server busy reading it.
+    """
+    png = b"\x89PNG\r\n\x1a\n" + bytes(size * 3 // 4)
+    encoded = base64.b64encode(png).decode()
+    return f'[{{"file": "data:image/png;base64,{encoded}"}}]'.encode()
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    api = args.api.rstrip("/") + "/"
+    deadline = time.monotonic() + args.duration
+    body = make_upload_body(args.upload_size)
+    trickle = (args.chunk_size, args.chunk_delay)
+
+    latencies, errors = [], []
+    tasks = [
+        slow_client(host, port, f"{api}upload/", body, trickle, deadline)
+        for _ in range(args.slow_clients)
+    ]
+    tasks += [
+        fast_client(host, port, f"{api}images/", deadline, latencies, errors)
+        for _ in range(args.fast_clients)
+    ]
+    await asyncio.gather(*tasks)
+
+    print(f"{api}: {args.slow_clients} slow uploads, {args.fast_clients} clients")
+    print(f"  requests: {len(latencies) / args.duration:.1f}/s, errors: {len(errors)}")
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"  latency: p50 {quantiles[49] * 1000:.1f} ms, "
+            f"p95 {quantiles[94] * 1000:.1f} ms, p99 {quantiles[98] * 1000:.1f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api", default="/api/", help="/api/ or /api/async/")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--slow-clients", type=int, default=16)
+    parser.add_argument("--fast-clients", type=int, default=32)
+    parser.add_argument("--upload-size", type=int, default=256 * 1024)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Replay API requests against a local gunicorn server and report the throughput,
+latency percentiles and peak server memory of each endpoint, optionally failing
+on regressions against a stored baseline.
+
+Each line of the scenarios file is a request, with a name, method, path and
+optional JSON body. Before the replay, a test image and PDF are uploaded, and
+$image_id and $pdf_id are replaced by their ids, and $image_base64 and
+$pdf_base64 by the Base64 data URIs of their files.
+
+Usage:
+    python benchmarks/replay.py [--scenarios benchmarks/scenarios.jsonl] \\
+        [--requests 200] [--concurrency 8] [--workers 4] [--database sqlite] \\
+        [--save-baseline FILE] [--baseline FILE] [--tolerance 0.2]
+
+The server is started with a temporary media directory and, with the default
+--database sqlite, a temporary SQLite database. With --database postgres, the
+DOCFORGE_DB_* environment variables select the database, which is migrated.
+With --url, requests go to a running server instead, and memory is not reported.
+SQLite serializes writes, so the write endpoints may fail with "database is
+locked" under concurrency; compare them on PostgreSQL.
+
+The peak RSS is the sum of the peak resident memory of the gunicorn processes
+during each endpoint's replay, read from /proc, so it is only reported on Linux.
+"""
+
+import argparse
+import base64
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from string import Template
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TEST_DATA_DIR = ROOT_DIR / "test" / "test_data"
+
+# Metrics compared with the baseline, and whether higher values are better.
+BASELINE_METRICS = {"throughput": True, "p50": False, "p95": False, "p99": False}
+
+
+def send(url, method, path, body=None):
+    """
+    Send a request and return its status code.
+    """
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url + path, data=data, method=method)
+    if data is not None:
+        request.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def get_data_uri(path, media_type):
+    encoded = base64.b64encode(path.read_bytes()).decode()
+    return f"data:{media_type};base64,{encoded}"
+
+
+def seed(url):
+    """
+    Upload the test image and PDF, and return the values substituted in the
+    scenarios.
+    """
+    values = {
+        "image_base64": get_data_uri(TEST_DATA_DIR / "test_image.jpg", "image/jpeg"),
+        "pdf_base64": get_data_uri(
+            TEST_DATA_DIR / "test_document.pdf", "application/pdf"
+        ),
+    }
+    body = json.dumps(
+        [{"file": values["image_base64"]}, {"file": values["pdf_base64"]}]
+    )
+    request = urllib.request.Request(
+        url + "/api/upload/",
+        data=body.encode(),
+        method="POST",
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        values["image_id"], values["pdf_id"] = json.load(response)["documents"]
+    return values
+
+
+def load_scenarios(path, values):
+    with open(path) as scenarios:
+        return [
+            json.loads(Template(line).safe_substitute(values))
+            for line in scenarios
+            if line.strip()
+        ]
+
+
+def start_server(args, media_root):
+    """
+    Migrate the database and start gunicorn, and return its process and URL.
+    """
+    environment = dict(
+        os.environ,
+        DOCFORGE_MEDIA_ROOT=str(media_root / "media"),
+        DOCFORGE_STORAGE_CACHE_DIR=str(media_root / "cache"),
+    )
+    if args.database == "sqlite":
+        environment["DOCFORGE_DB_ENGINE"] = "django.db.backends.sqlite3"
+        environment["DOCFORGE_DB_NAME"] = str(media_root / "docforge.db")
+    subprocess.run(
+        [sys.executable, "manage.py", "migrate", "--verbosity", "0"],
+        cwd=ROOT_DIR,
+        env=environment,
+        check=True,
+    )
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "docforge.wsgi:application",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT_DIR,
+        env=environment,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start.")
+
+
+def get_server_pids(server):
+    """
+    Return the ids of the gunicorn master process and of its workers.
+    """
+    pids = [server.pid]
+    try:
+        with open(f"/proc/{server.pid}/task/{server.pid}/children") as children:
+            pids += [int(pid) for pid in children.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+def reset_peak_rss(pids):
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            pass
+
+
+def get_peak_rss(pids):
+    """
+    Return the sum of the peak resident memory of processes, in bytes, or None
+    where /proc is not available.
+    """
+    total = None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        total = (total or 0) + int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def replay(url, scenario, requests, concurrency):
+    """
+    Send a scenario's request ``requests`` times from ``concurrency`` threads,
+    and return the latencies of the successful ones, the number of errors and
+    the elapsed time.
+    """
+
+    def timed_send(_):
+        start = time.perf_counter()
+        try:
+            status = send(
+                url, scenario["method"], scenario["path"], scenario.get("body")
+            )
+        except OSError:
+            status = None
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for status, latency in results if status and status < 400]
+    return latencies, len(results) - len(latencies), elapsed
+
+
+def summarize(latencies, errors, elapsed, peak_rss):
+    quantiles = (
+        statistics.quantiles(latencies, n=100)
+        if len(latencies) >= 2
+        else [latencies[0] if latencies else 0] * 99
+    )
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": quantiles[49] * 1000,
+        "p95": quantiles[94] * 1000,
+        "p99": quantiles[98] * 1000,
+        "errors": errors,
+        "peak_rss": peak_rss,
+    }
+
+
+def print_results(results):
+    print(
+        f"{'endpoint':>16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7} {'RSS MiB':>8}"
+    )
+    for name, result in results.items():
+        peak_rss = result["peak_rss"]
+        rss = f"{peak_rss / 1024 / 1024:.0f}" if peak_rss else "-"
+        print(
+            f"{name:>16} {result['throughput']:>8.1f} {result['p50']:>8.1f} "
+            f"{result['p95']:>8.1f} {result['p99']:>8.1f} {result['errors']:>7} "
+            f"{rss:>8}"
+        )
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Return a message for each metric worse than in the baseline by more than
+    ``tolerance``, a fraction, and for each endpoint failing more requests.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        for metric, higher_is_better in BASELINE_METRICS.items():
+            value, reference = result[metric], expected[metric]
+            if higher_is_better:
+                regressed = value < reference * (1 - tolerance)
+            else:
+                regressed = value > reference * (1 + tolerance)
+            if regressed:
+                regressions.append(
+                    f"{name}: {metric} {value:.1f}, baseline {reference:.1f}"
+                )
+        if result["errors"] > expected["errors"]:
+            regressions.append(
+                f"{name}: {result['errors']} errors, baseline {expected['errors']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios", default=str(ROOT_DIR / "benchmarks" / "scenarios.jsonl")
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--database", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--url", help="URL of a running server to replay against.")
+    parser.add_argument("--save-baseline", help="File to save the results to.")
+    parser.add_argument("--baseline", help="File of results to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        url = args.url
+        if not url:
+            server, url = start_server(args, Path(directory))
+        try:
+            scenarios = load_scenarios(args.scenarios, seed(url))
+            pids = get_server_pids(server) if server else []
+
+            results = {}
+            for scenario in scenarios:
+                reset_peak_rss(pids)
+                latencies, errors, elapsed = replay(
+                    url, scenario, args.requests, args.concurrency
+                )
+                results[scenario["name"]] = summarize(
+                    latencies, errors, elapsed, get_peak_rss(pids)
+                )
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    print(f"{args.requests} requests per endpoint, {args.concurrency} clients")
+    print_results(results)
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save_baseline, "w") as baseline:
+            json.dump(results, baseline, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results, json.load(baseline), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
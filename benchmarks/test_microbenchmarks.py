@@ -0,0 +1,102 @@
+"""
+Micro-benchmarks of the hot paths behind the API endpoints, for pytest-benchmark.
+
+Usage:
+    make bench
+
+or, to compare with the last saved run and fail on a slowdown of the median:
+
+    pytest benchmarks --benchmark-autosave --benchmark-compare \\
+        --benchmark-compare-fail=median:20%
+"""
+
+import base64
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from docengine.conversion import render_pages
+from docengine.imaging import rotate_image
+from docengine.metadata import read_pdf_metadata
+from docengine.models import Document
+from docengine.serializer import DocumentListSerializer, ImageSerializer, PdfSerializer
+
+TEST_DATA_DIR = Path(__file__).resolve().parent.parent / "test" / "test_data"
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path / "media"
+
+
+@pytest.fixture
+def jpeg_data():
+    image = Image.radial_gradient("L").resize((2000, 1500)).convert("RGB")
+    image_io = BytesIO()
+    image.save(image_io, format="JPEG", quality=90)
+    return image_io.getvalue()
+
+
+def test_image_serializer(benchmark):
+    document = Document(
+        media_type="image",
+        file="documents/ab/cd/image.jpg",
+        width=800,
+        height=400,
+        channels=3,
+        image_format="JPEG",
+        frame_count=1,
+        orientation=1,
+    )
+    data = benchmark(lambda: ImageSerializer(document).data)
+    assert data["width"] == 800
+
+
+def test_pdf_serializer(benchmark):
+    page_dimensions = [{"width": 596.0, "height": 842.0}] * 1000
+    document = Document(
+        media_type="pdf",
+        file="documents/ab/cd/document.pdf",
+        num_pages=len(page_dimensions),
+        page_dimensions=page_dimensions,
+    )
+    data = benchmark(lambda: PdfSerializer(document).data)
+    assert data["num_pages"] == 1000
+
+
+def test_base64_decode(benchmark, jpeg_data):
+    encoded = base64.b64encode(jpeg_data).decode()
+    item = {"file": f"data:image/jpeg;base64,{encoded}"}
+
+    def decode():
+        serializer = DocumentListSerializer(data=item)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data["file"]
+
+    assert benchmark(decode).size
+
+
+@pytest.mark.parametrize("angle", [90, 45])
+def test_rotate(benchmark, jpeg_data, angle):
+    data, _ = benchmark(lambda: rotate_image(BytesIO(jpeg_data), angle))
+    assert data
+
+
+def test_read_pdf_metadata(benchmark):
+    path = TEST_DATA_DIR / "test_document.pdf"
+
+    def read():
+        with open(path, "rb") as file:
+            return read_pdf_metadata(file)
+
+    assert benchmark(read)["num_pages"] == 2
+
+
+def test_rasterize(benchmark):
+    path = TEST_DATA_DIR / "test_document.pdf"
+    documents = benchmark.pedantic(
+        render_pages, args=(path, 1, 2), kwargs={"dpi": 100}, rounds=3
+    )
+    assert len(documents) == 2
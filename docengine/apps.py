@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class DocengineConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "docengine"
+
+    def ready(self):
+        from docengine.instrumentation import install_query_timer
+
+        connection_created.connect(install_query_timer)
@@ -0,0 +1,217 @@
+"""
+Async variants of the document endpoints, for deployments under an ASGI server.
+
+Under ASGI, request bodies are received by the event loop before the view runs,
+so slow clients do not hold a worker. Queries go through Django's async ORM,
+while CPU-bound work (Base64 decoding, PIL and pypdf) and blocking file writes
+run in a thread pool.
+"""
+
+import asyncio
+import base64
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import ValidationError
+
+from docengine.pagination import DocumentCursorPagination
+from docengine.serializer import (
+    DocumentFilterSerializer,
+    DocumentSerializer,
+    ImageSerializer,
+    PdfSerializer,
+)
+from docengine.uploads import prepare_uploads
+
+from .models import Document
+
+
+def encode_cursor(document):
+    """
+    Return an opaque cursor pointing after ``document`` in the list ordering.
+    """
+    position = f"{document.uploaded_at.isoformat()}|{document.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the (uploaded_at, id) position encoded in ``cursor``. Raise
+    ValueError if the cursor is invalid.
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+        uploaded_at, document_id = position.split("|")
+        return datetime.fromisoformat(uploaded_at), document_id
+    except (UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncDocumentUploadView(View):
+    """
+    Async API endpoint for uploading multiple documents in Base64 format, with
+    the same per-item results as the sync endpoint.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body."}, status=400)
+
+        if not isinstance(data, list):
+            return JsonResponse({"error": "Expected a list of files."}, status=400)
+
+        # Hashing, metadata extraction and storage writes, without queries.
+        results = await asyncio.to_thread(prepare_uploads, data)
+        errors = {index: error for index, (_, error) in enumerate(results) if error}
+        if errors and len(errors) == len(results):
+            return JsonResponse({"error": errors}, status=400)
+
+        documents = await sync_to_async(Document.objects.ingest)(
+            [document for document, _ in results if document]
+        )
+        response = {
+            "message": "Documents uploaded successfully",
+            "documents": [doc.id for doc in documents],
+        }
+        if errors:
+            response["errors"] = errors
+        return JsonResponse(response, status=201)
+
+
+class AsyncDocumentListView(View):
+    """
+    Base async API endpoint for paginated lists of documents of one media type,
+    newest first, with the same filters as the sync lists.
+    """
+
+    media_type = None
+
+    async def get(self, request, *args, **kwargs):
+        filters = DocumentFilterSerializer(data=request.GET)
+        if not filters.is_valid():
+            return JsonResponse(filters.errors, status=400)
+
+        pagination = DocumentCursorPagination()
+        try:
+            page_size = min(
+                int(request.GET.get("page_size", pagination.page_size)),
+                pagination.max_page_size,
+            )
+            cursor = request.GET.get("cursor")
+            position = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        if page_size < 1:
+            return JsonResponse({"error": "Invalid page size."}, status=400)
+
+        queryset = Document.objects.filter(media_type=self.media_type).only(
+            "id", "media_type", "file", "uploaded_at"
+        )
+        queryset = filters.filter_queryset(queryset)
+        if position:
+            uploaded_at, document_id = position
+            queryset = queryset.filter(
+                Q(uploaded_at__lt=uploaded_at)
+                | Q(uploaded_at=uploaded_at, id__lt=document_id)
+            )
+
+        # Fetch one more document to know whether there is a next page.
+        queryset = queryset.order_by(*pagination.ordering)[: page_size + 1]
+        documents = [document async for document in queryset]
+
+        next_url = None
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            query = request.GET.copy()
+            query["cursor"] = encode_cursor(documents[-1])
+            next_url = request.build_absolute_uri(f"?{query.urlencode()}")
+
+        return JsonResponse(
+            {
+                "next": next_url,
+                "results": DocumentSerializer(documents, many=True).data,
+            }
+        )
+
+
+class AsyncImageListView(AsyncDocumentListView):
+    """
+    Async API endpoint for retrieving a list of all uploaded images.
+    """
+
+    media_type = "image"
+
+
+class AsyncPdfListView(AsyncDocumentListView):
+    """
+    Async API endpoint for retrieving a list of all uploaded PDFs.
+    """
+
+    media_type = "pdf"
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncDocumentRetrieveDeleteView(View):
+    """
+    Base async API view to retrieve or delete a document.
+    """
+
+    media_type = None
+    serializer_class = None
+
+    not_found = {"detail": "No Document matches the given query."}
+
+    async def get_document(self, id):
+        try:
+            return await Document.objects.aget(id=id, media_type=self.media_type)
+        except Document.DoesNotExist:
+            return None
+
+    async def get(self, request, id):
+        document = await self.get_document(id)
+        if document is None:
+            return JsonResponse(self.not_found, status=404)
+
+        if not document.has_metadata:
+            await sync_to_async(document.ensure_metadata)()
+        serializer = self.serializer_class(document, context={"request": request})
+        try:
+            return JsonResponse(serializer.data)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=400)
+
+    async def delete(self, request, id):
+        document = await self.get_document(id)
+        if document is None:
+            return JsonResponse(self.not_found, status=404)
+
+        # Releasing runs in a transaction, which the async ORM does not support.
+        await sync_to_async(document.release)()
+        return HttpResponse(status=204)
+
+
+class AsyncImageRetrieveDeleteView(AsyncDocumentRetrieveDeleteView):
+    """
+    Async API view to retrieve or delete an image document.
+    """
+
+    media_type = "image"
+    serializer_class = ImageSerializer
+
+
+class AsyncPdfRetrieveDeleteView(AsyncDocumentRetrieveDeleteView):
+    """
+    Async API view to retrieve or delete a PDF document.
+    """
+
+    media_type = "pdf"
+    serializer_class = PdfSerializer
@@ -0,0 +1,375 @@
+import os
+import tempfile
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from pdf2image import convert_from_path
+from pdf2image.exceptions import (
+    PDFInfoNotInstalledError,
+    PDFPageCountError,
+    PDFPopplerTimeoutError,
+    PDFSyntaxError,
+)
+
+from docengine.instrumentation import span
+from docengine.models import ConversionJob, ConversionJobImage, Derivative, Document
+from docengine.storage import get_local_path
+
+OUTPUT_EXTENSIONS = {
+    "jpeg": "jpg",
+    "png": "png",
+}
+
+# Errors of poppler failing to render a PDF, or missing, and of reading the PDF.
+RENDER_ERRORS = (
+    PDFInfoNotInstalledError,
+    PDFPageCountError,
+    PDFPopplerTimeoutError,
+    PDFSyntaxError,
+    OSError,
+)
+
+
+def get_page_range(document, first_page=None, last_page=None):
+    """
+    Return the first and last page to convert from a PDF document, defaulting
+    to the whole document. Raise ValueError if the range has no pages.
+    """
+    document.ensure_metadata()
+    first_page = first_page or 1
+    last_page = min(last_page or document.num_pages, document.num_pages)
+    if first_page > last_page:
+        raise ValueError(
+            f"Invalid page range {first_page}-{last_page} "
+            f"for a PDF with {document.num_pages} pages."
+        )
+    return first_page, last_page
+
+
+def get_render_workers():
+    """
+    Return the number of poppler processes to run in parallel for a conversion.
+    """
+    if settings.CONVERSION_RENDER_WORKERS:
+        return settings.CONVERSION_RENDER_WORKERS
+    # The CPUs this process may run on, which respects container CPU sets.
+    return len(os.sched_getaffinity(0))
+
+
+def render_pages(pdf_path, first_page, last_page, dpi=200, fmt="jpeg"):
+    """
+    Render a range of pages of a PDF file and store each page in the storage.
+    Return the page images as unsaved image Documents, in page order, to be
+    saved with ``Document.objects.ingest()``.
+
+    poppler writes the pages to a temporary directory, and each one is moved to
+    the storage and removed before the next, so no page is held in memory. If a
+    page fails, the pages already stored are deleted.
+    """
+    extension = OUTPUT_EXTENSIONS[fmt]
+    documents = []
+    with tempfile.TemporaryDirectory() as output_folder:
+        with span("pdf.render"):
+            paths = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                fmt=fmt,
+                first_page=first_page,
+                last_page=last_page,
+                output_folder=output_folder,
+                paths_only=True,
+            )
+        try:
+            for path in paths:
+                with open(path, "rb") as image_file:
+                    document = Document(
+                        file=File(image_file, name=f"{uuid.uuid4()}.{extension}"),
+                        media_type="image",
+                    )
+                    document.prepare_file()
+                os.remove(path)
+                documents.append(document)
+        except Exception:
+            delete_unreferenced_files(documents)
+            raise
+    return documents
+
+
+def render_page_image(pdf_path, page, dpi=200, fmt="jpeg"):
+    """
+    Render a single page of a PDF file and return the encoded image.
+    """
+    with tempfile.TemporaryDirectory() as output_folder:
+        with span("pdf.render"):
+            (path,) = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                fmt=fmt,
+                first_page=page,
+                last_page=page,
+                output_folder=output_folder,
+                single_file=True,
+                paths_only=True,
+            )
+        with open(path, "rb") as image_file:
+            return image_file.read()
+
+
+def delete_unreferenced_files(documents):
+    """
+    Delete the stored files of unsaved documents, except the files shared with
+    saved documents of the same content.
+    """
+    referenced = set(
+        Document.objects.filter(
+            content_hash__in=[document.content_hash for document in documents]
+        ).values_list("content_hash", flat=True)
+    )
+    for document in documents:
+        if document.content_hash not in referenced:
+            document.file.delete(save=False)
+
+
+def get_page_batches(first_page, last_page):
+    """
+    Return the (first, last) page ranges of ``CONVERSION_PAGE_BATCH_SIZE`` pages
+    rendered by each poppler process.
+    """
+    batch_size = settings.CONVERSION_PAGE_BATCH_SIZE
+    return [
+        (batch_first, min(batch_first + batch_size - 1, last_page))
+        for batch_first in range(first_page, last_page + 1, batch_size)
+    ]
+
+
+def render_page_range(
+    pdf_path, first_page, last_page, dpi=200, fmt="jpeg", workers=None, progress=None
+):
+    """
+    Render a range of pages of a PDF file in batches of
+    ``CONVERSION_PAGE_BATCH_SIZE`` pages, running up to ``workers`` poppler
+    processes at once. Return the page images as unsaved image Documents, in
+    page order. ``progress`` is called with the number of pages done and the
+    total number of pages after each batch.
+
+    If a batch fails, the other batches are still waited for, and the pages of
+    all of them are deleted before the first error is raised.
+    """
+    workers = workers or get_render_workers()
+    pages_total = last_page - first_page + 1
+    batches = get_page_batches(first_page, last_page)
+
+    documents = []
+    error = None
+    # Each batch runs in its own poppler process, so threads are enough to use
+    # several cores. The futures are read in page order.
+    with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        futures = [
+            pool.submit(render_pages, pdf_path, *pages, dpi=dpi, fmt=fmt)
+            for pages in batches
+        ]
+        for future in futures:
+            try:
+                documents.extend(future.result())
+                if progress and error is None:
+                    progress(len(documents), pages_total)
+            except Exception as e:
+                error = error or e
+    if error:
+        delete_unreferenced_files(documents)
+        raise error
+
+    return documents
+
+
+def get_convert_params(document, first_page=None, last_page=None, dpi=200, fmt="jpeg"):
+    """
+    Return the derivative cache parameters of a conversion. Raise ValueError if
+    the page range has no pages.
+    """
+    first_page, last_page = get_page_range(document, first_page, last_page)
+    return {"first_page": first_page, "last_page": last_page, "dpi": dpi, "fmt": fmt}
+
+
+def convert_pdf_to_images(
+    document,
+    first_page=None,
+    last_page=None,
+    dpi=200,
+    fmt="jpeg",
+    workers=None,
+    progress=None,
+):
+    """
+    Render the pages of a PDF document to images and store each one as an
+    image Document. ``progress`` is called with the number of pages done and
+    the total number of pages as the conversion goes.
+
+    Converting the same pages with the same options again returns the images
+    of the first conversion, as long as they are in the derivative cache.
+    """
+    params = get_convert_params(document, first_page, last_page, dpi, fmt)
+    first_page, last_page = params["first_page"], params["last_page"]
+
+    cached = Derivative.objects.lookup(document, "convert", params)
+    if cached:
+        if progress:
+            progress(len(cached), len(cached))
+        return cached
+
+    new_images = render_page_range(
+        get_local_path(document.file.storage, document.file.name),
+        first_page,
+        last_page,
+        dpi=dpi,
+        fmt=fmt,
+        workers=workers,
+        progress=progress,
+    )
+    new_images = Document.objects.ingest(new_images)
+    Derivative.objects.store(document, "convert", params, new_images)
+    return new_images
+
+
+def convert_pdfs_to_images(items, workers=None):
+    """
+    Convert the PDF documents of a list of (document, options) pairs, rendering
+    the page batches of all of them in one pool of poppler processes, and save
+    the page images together.
+
+    Return a list with, for each item in order, a pair of the page images or
+    None, and an error message or None. Conversions already in the derivative
+    cache are not rendered again, and neither are repeated items.
+    """
+    workers = workers or get_render_workers()
+    requests = []
+    results = [None] * len(items)
+    for index, (document, options) in enumerate(items):
+        try:
+            requests.append((index, document, get_convert_params(document, **options)))
+        except ValueError as e:
+            results[index] = (None, str(e))
+
+    keys = {
+        index: (document.id, Derivative.normalize(params))
+        for index, document, params in requests
+    }
+    cached = Derivative.objects.lookup_many(
+        "convert", [(document, params) for _, document, params in requests]
+    )
+    cached = {index: outputs for (index, _, _), outputs in zip(requests, cached)}
+
+    pending = {}
+    for index, document, params in requests:
+        if cached[index] is None:
+            pending.setdefault(keys[index], (document, params))
+
+    def render(task):
+        key, pdf_path, pages, params = task
+        try:
+            return (
+                key,
+                render_pages(pdf_path, *pages, dpi=params["dpi"], fmt=params["fmt"]),
+                None,
+            )
+        except Exception as e:
+            return key, [], str(e)
+
+    pages = defaultdict(list)
+    errors = {}
+    tasks = []
+    for key, (document, params) in pending.items():
+        try:
+            pdf_path = get_local_path(document.file.storage, document.file.name)
+        except OSError as e:
+            errors[key] = str(e)
+            continue
+        for batch in get_page_batches(params["first_page"], params["last_page"]):
+            tasks.append((key, pdf_path, batch, params))
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            # map() yields the batches in task order, so in page order.
+            for key, documents, error in pool.map(render, tasks):
+                pages[key].extend(documents)
+                if error:
+                    errors.setdefault(key, error)
+    for key in errors:
+        failed_pages = pages.pop(key, [])
+        if failed_pages:
+            delete_unreferenced_files(failed_pages)
+
+    # Repeated items get the same page images, with a reference each.
+    new_images = [
+        image
+        for index, _, _ in requests
+        if cached[index] is None and keys[index] not in errors
+        for image in pages[keys[index]]
+    ]
+    saved = iter(Document.objects.ingest(new_images))
+
+    entries = []
+    for index, document, params in requests:
+        key = keys[index]
+        if cached[index] is not None:
+            results[index] = (cached[index], None)
+        elif key in errors:
+            results[index] = (None, errors[key])
+        else:
+            images = [next(saved) for _ in pages[key]]
+            results[index] = (images, None)
+            entries.append((document, params, images))
+    Derivative.objects.store_many("convert", entries)
+    return results
+
+
+def run_conversion_job(job):
+    """
+    Convert the PDF of a claimed job and record the outcome on the job.
+
+    The outcome is only recorded while the job is still held by this claim: a
+    job deleted with its PDF, or queued again after a timeout and claimed by
+    another worker, is left as it is.
+    """
+
+    def progress(pages_done, pages_total):
+        job.held().update(
+            pages_done=pages_done,
+            pages_total=pages_total,
+            heartbeat_at=timezone.now(),
+        )
+
+    try:
+        images = convert_pdf_to_images(job.document, progress=progress, **job.options)
+    except Exception as e:
+        job.held().update(status="failed", error=str(e), finished_at=timezone.now())
+        return
+
+    with transaction.atomic():
+        # The update locks the job's row until its images are recorded.
+        done = job.held().update(
+            status="done",
+            pages_done=len(images),
+            pages_total=len(images),
+            finished_at=timezone.now(),
+        )
+        if done:
+            ConversionJobImage.objects.bulk_create(
+                ConversionJobImage(job=job, image=image, page_number=page_number)
+                for page_number, image in enumerate(images, 1)
+            )
+
+
+def process_next_job():
+    """
+    Claim and run the oldest queued conversion job. Return the job, or None if
+    there was nothing to do.
+    """
+    job = ConversionJob.claim_next()
+    if job is not None:
+        run_conversion_job(job)
+    return job
@@ -0,0 +1,140 @@
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from docengine.storage import is_local_storage
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    Return the first and last byte of a single range ``Range`` header for a
+    file of ``size`` bytes, or None to send the whole file. Raise ValueError
+    if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges are answered with the whole file, as RFC 9110 allows.
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The last N bytes.
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first >= size or first > last:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return first, last
+
+
+def get_detail_cache_policy(storage):
+    """
+    Return the Cache-Control header and the server-side cache timeout of the
+    detail responses of documents whose files are in ``storage``.
+
+    Documents never change once uploaded, so their details are immutable, unless
+    their location is a signed URL, which expires.
+    """
+    if getattr(storage, "querystring_auth", False):
+        max_age = storage.querystring_expire // 2
+        return f"private, max-age={max_age}", max_age
+    return (
+        f"public, max-age={settings.DETAIL_MAX_AGE}, immutable",
+        settings.DETAIL_CACHE_TIMEOUT,
+    )
+
+
+def read_range(file, first, last, chunk_size):
+    """
+    Yield the bytes of a file from ``first`` to ``last`` included, and close it.
+    """
+    try:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve_file(request, storage, name, etag, last_modified):
+    """
+    Return a response delivering a stored file, answering conditional and
+    range requests.
+
+    With ``USE_X_ACCEL_REDIRECT`` the response only tells nginx which file to
+    send, so the file never goes through the application worker. Files of
+    remote storages are delivered by the storage, through a redirect to a
+    presigned URL. Otherwise the file is streamed by Django, which is meant for
+    development.
+    """
+    last_modified = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        # A range only applies if the client still has the same version.
+        if_range = request.headers.get("If-Range")
+        use_range = if_range in (None, etag, http_date(last_modified))
+        response = get_file_response(request, storage, name, use_range)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def get_file_response(request, storage, name, use_range=True):
+    content_type, _ = mimetypes.guess_type(name)
+    content_type = content_type or "application/octet-stream"
+
+    if not is_local_storage(storage):
+        return HttpResponseRedirect(storage.url(name))
+
+    if settings.USE_X_ACCEL_REDIRECT:
+        # nginx serves the file, including range requests.
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = quote(settings.X_ACCEL_REDIRECT_PREFIX + name)
+        return response
+
+    size = storage.size(name)
+    try:
+        byte_range = parse_range(request.headers.get("Range", ""), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if not use_range:
+        byte_range = None
+
+    if byte_range is None:
+        response = FileResponse(storage.open(name, "rb"), content_type=content_type)
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            read_range(storage.open(name, "rb"), first, last, FileResponse.block_size),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(last - first + 1)
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -0,0 +1,143 @@
+import struct
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from docengine.instrumentation import span
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+}
+
+# Transpositions equivalent to counter-clockwise rotations by right angles.
+RIGHT_ANGLE_TRANSPOSES = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation for each clockwise rotation applied when displaying an image.
+# Mirrored orientations are left out and always rotated by their pixels.
+EXIF_ORIENTATIONS = {0: 1, 90: 6, 180: 3, 270: 8}
+EXIF_ROTATIONS = {
+    orientation: angle for angle, orientation in EXIF_ORIENTATIONS.items()
+}
+
+
+@span("image.rotate")
+def rotate_image(
+    file, angle, resample="nearest", fill_color=None, exif_orientation=False
+):
+    """
+    Rotate an image counter-clockwise by ``angle`` degrees and return the
+    rotated image encoded in its original format, along with that format.
+
+    Right angles are rotated with a transposition, which moves pixels without
+    resampling them. With ``exif_orientation``, JPEG images rotated by a right
+    angle only get their EXIF orientation rewritten, which keeps the encoded
+    image data untouched.
+    """
+    angle = angle % 360
+    image = Image.open(file)
+    original_format = image.format
+
+    if exif_orientation and original_format == "JPEG" and angle % 90 == 0:
+        exif = image.getexif()
+        orientation = exif.get(EXIF_ORIENTATION_TAG, 1)
+        if orientation in EXIF_ROTATIONS:
+            clockwise = (EXIF_ROTATIONS[orientation] - int(angle)) % 360
+            exif[EXIF_ORIENTATION_TAG] = EXIF_ORIENTATIONS[clockwise]
+            file.seek(0)
+            return set_jpeg_exif(file.read(), exif.tobytes()), original_format
+
+    if angle in RIGHT_ANGLE_TRANSPOSES:
+        rotated_image = image.transpose(RIGHT_ANGLE_TRANSPOSES[angle])
+    else:
+        rotated_image = image.rotate(
+            angle,
+            resample=RESAMPLE_FILTERS[resample],
+            expand=True,
+            fillcolor=fill_color,
+        )
+
+    save_options = {}
+    if original_format == "JPEG":
+        # Reuse the quantization tables of the original so that the rotated
+        # image keeps its quality and size.
+        save_options["qtables"] = image.quantization
+
+    image_io = BytesIO()
+    rotated_image.save(image_io, format=original_format, **save_options)
+    return image_io.getvalue(), original_format
+
+
+def set_jpeg_exif(data, exif):
+    """
+    Return JPEG ``data`` with its EXIF segment replaced by ``exif``, without
+    decoding or re-encoding the image.
+    """
+    exif_segment = b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+
+    segments = []
+    position = 2
+    # Walk the APPn and COM segments that precede the image data.
+    while data[position] == 0xFF and (
+        0xE0 <= data[position + 1] <= 0xEF or data[position + 1] == 0xFE
+    ):
+        (length,) = struct.unpack(">H", data[position + 2 : position + 4])
+        segment = data[position : position + 2 + length]
+        if not (segment[1] == 0xE1 and segment[4:10] == b"Exif\x00\x00"):
+            segments.append(segment)
+        position += 2 + length
+
+    # The EXIF segment goes right after the JFIF segment if there is one.
+    index = 1 if segments and segments[0][:2] == b"\xff\xe0" else 0
+    segments.insert(index, exif_segment)
+    return b"\xff\xd8" + b"".join(segments) + data[position:]
+
+
+RENDITION_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+    "png": "PNG",
+}
+
+
+def fit_size(size, bounds):
+    """
+    Return ``size`` scaled down to fit within ``bounds``, keeping its aspect
+    ratio. Sizes that already fit are returned unchanged.
+    """
+    scale = min(bounds[0] / size[0], bounds[1] / size[1], 1)
+    return max(round(size[0] * scale), 1), max(round(size[1] * scale), 1)
+
+
+@span("image.thumbnail")
+def render_thumbnail(file, size, fmt="webp"):
+    """
+    Return an image resized to fit within ``size``, keeping its aspect ratio,
+    encoded in ``fmt``. Images are never enlarged. ``size`` is the size as
+    displayed, the EXIF orientation of the image is applied.
+
+    JPEG images are decoded at the smallest of 1/1, 1/2, 1/4 or 1/8 scale that
+    is still larger than ``size``, which skips most of the decoding work.
+    """
+    with Image.open(file) as image:
+        # Orientations 5 to 8 are rotated by 90 or 270 degrees, so the stored
+        # image is drafted at the transposed size.
+        if image.getexif().get(EXIF_ORIENTATION_TAG, 1) >= 5:
+            image.draft(image.mode, (size[1], size[0]))
+        else:
+            image.draft(image.mode, size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        image_io = BytesIO()
+        image.save(image_io, format=RENDITION_FORMATS[fmt])
+    return image_io.getvalue()
@@ -0,0 +1,241 @@
+"""
+Opt-in timing of the hot paths of the document endpoints.
+
+Code paths are wrapped in ``span(name)``, which adds their duration to
+process-wide counters, exposed in the Prometheus text format by the metrics
+endpoint, and to the trace of the current request, logged as one JSON line per
+request by ``InstrumentationMiddleware``. Both are enabled with the
+INSTRUMENTATION setting, and spans cost a settings lookup otherwise.
+
+Spans in the thread pools of batch endpoints are counted in the metrics, but
+not in the trace of the request, which is bound to the request's thread.
+
+Under several gunicorn workers, each worker has its own counters, and a scrape
+reads those of the worker answering it.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Spans of the request being handled, by name: [count, total seconds].
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    """
+    Process-wide counters of span durations and of requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = defaultdict(lambda: [0, 0.0])
+            self.requests = defaultdict(lambda: [0, 0.0])
+
+    def add_span(self, name, duration):
+        with self.lock:
+            span = self.spans[name]
+            span[0] += 1
+            span[1] += duration
+
+    def add_request(self, method, view, status, duration):
+        with self.lock:
+            request = self.requests[(method, view, status)]
+            request[0] += 1
+            request[1] += duration
+
+    def render(self):
+        """
+        Return the counters in the Prometheus text exposition format.
+        """
+        with self.lock:
+            spans = sorted(self.spans.items())
+            requests = sorted(self.requests.items())
+
+        lines = [
+            "# HELP docforge_span_seconds Time spent in instrumented code paths.",
+            "# TYPE docforge_span_seconds summary",
+        ]
+        for name, (count, total) in spans:
+            lines.append(f'docforge_span_seconds_count{{span="{name}"}} {count}')
+            lines.append(f'docforge_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines += [
+            "# HELP docforge_request_seconds Time spent handling requests.",
+            "# TYPE docforge_request_seconds summary",
+        ]
+        for (method, view, status), (count, total) in requests:
+            labels = f'method="{method}",view="{view}",status="{status}"'
+            lines.append(f"docforge_request_seconds_count{{{labels}}} {count}")
+            lines.append(f"docforge_request_seconds_sum{{{labels}}} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as the span ``name``, when instrumentation is on.
+    """
+    if not settings.INSTRUMENTATION:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics.add_span(name, duration)
+        trace = current_trace.get()
+        if trace is not None:
+            trace[name][0] += 1
+            trace[name][1] += duration
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing every query as the "db.query" span.
+    """
+    with span("db.query"):
+        return execute(sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    Add the query timer to each new database connection, which also times the
+    queries of the async ORM, run in another thread than the request's.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def get_profile_path(request):
+    """
+    Return the file to dump the profile of ``request`` to.
+    """
+    path = re.sub(r"[^\w]+", "-", request.path).strip("-") or "root"
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{path}-{os.getpid()}.prof"
+    return os.path.join(settings.PROFILE_DIR, filename)
+
+
+class InstrumentationMiddleware:
+    """
+    Log the duration, status, query count and spans of each request as JSON,
+    and count them in the metrics.
+
+    A request with the PROFILE_HEADER header set to PROFILE_TOKEN is also run
+    under cProfile, and its profile is dumped to PROFILE_DIR, to be read with
+    ``python -m pstats`` or snakeviz.
+
+    The middleware supports both sync and async requests, so that it does not
+    move the async views to a thread under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        if not settings.INSTRUMENTATION:
+            return self.get_response(request)
+
+        trace = defaultdict(lambda: [0, 0.0])
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        profiler = self.start_profile(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        return self.finish(request, response, trace, start, profiler)
+
+    async def acall(self, request):
+        if not settings.INSTRUMENTATION:
+            return await self.get_response(request)
+
+        trace = defaultdict(lambda: [0, 0.0])
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        profiler = self.start_profile(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_trace.reset(token)
+        return self.finish(request, response, trace, start, profiler)
+
+    def start_profile(self, request):
+        """
+        Return a running profiler if the request asks to be profiled, or None.
+        """
+        token = settings.PROFILE_TOKEN
+        if not token or request.headers.get(settings.PROFILE_HEADER) != token:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, request, response, trace, start, profiler):
+        duration = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            path = get_profile_path(request)
+            profiler.dump_stats(path)
+            response["X-Profile"] = os.path.basename(path)
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        metrics.add_request(request.method, view, response.status_code, duration)
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "view": view,
+                    "status": response.status_code,
+                    "duration_ms": round(duration * 1000, 3),
+                    "spans": {
+                        name: {"count": count, "ms": round(total * 1000, 3)}
+                        for name, (count, total) in trace.items()
+                    },
+                }
+            )
+        )
+        return response
+
+
+def metrics_view(request):
+    """
+    Return the metrics of this process in the Prometheus text format.
+    """
+    if not settings.INSTRUMENTATION:
+        raise Http404
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from docengine.models import Document
+
+
+class Command(BaseCommand):
+    help = (
+        "Extract and store the metadata of documents uploaded before it was persisted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of documents updated per query.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        documents = Document.objects.missing_metadata().order_by("uploaded_at")
+
+        batch = []
+        updated = failed = 0
+        for document in documents.iterator(chunk_size=batch_size):
+            try:
+                document.extract_metadata()
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Failed to read {document.id}: {e}")
+                continue
+
+            batch.append(document)
+            if len(batch) >= batch_size:
+                Document.objects.bulk_update(batch, Document.METADATA_FIELDS)
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            Document.objects.bulk_update(batch, Document.METADATA_FIELDS)
+            updated += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated {updated} documents, {failed} failed.")
+        )
@@ -0,0 +1,101 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from docengine.models import Document
+from docengine.storage import is_local_storage
+
+
+def scan_files(path):
+    """
+    Yield the path and modification time of every file under a directory, with
+    os.scandir(), which gets both without a stat() call per file on most systems.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False).st_mtime
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the files of the documents directory that no document refers to, "
+        "such as files left behind by interrupted uploads or deletes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of files checked per query.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help=(
+                "Only delete files older than this many seconds, files of uploads "
+                "in progress are stored before their document is saved."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the orphaned files.",
+        )
+
+    def handle(self, *args, **options):
+        storage = Document._meta.get_field("file").storage
+        if not is_local_storage(storage):
+            raise CommandError("Only local storages can be reconciled.")
+        media_root = storage.path("")
+
+        directory = os.path.join(media_root, "documents")
+        if not os.path.isdir(directory):
+            self.stdout.write("No documents directory.")
+            return
+
+        cutoff = time.time() - options["min_age"]
+        self.dry_run = options["dry_run"]
+        self.media_root = media_root
+        checked = orphaned = 0
+        batch = []
+        for path, mtime in scan_files(directory):
+            if mtime > cutoff:
+                continue
+            batch.append(os.path.relpath(path, media_root).replace(os.sep, "/"))
+            if len(batch) >= options["batch_size"]:
+                orphaned += self.reconcile(batch)
+                checked += len(batch)
+                batch = []
+        if batch:
+            orphaned += self.reconcile(batch)
+            checked += len(batch)
+
+        action = "Found" if self.dry_run else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} files. {action} {orphaned} orphans.")
+        )
+
+    def reconcile(self, names):
+        """
+        Delete the files of a batch that no document refers to, with one query.
+        Return their number.
+        """
+        referenced = set(
+            Document.objects.filter(file__in=names).values_list("file", flat=True)
+        )
+        orphans = [name for name in names if name not in referenced]
+        for name in orphans:
+            if self.dry_run:
+                self.stdout.write(name)
+            else:
+                try:
+                    os.remove(os.path.join(self.media_root, name))
+                except FileNotFoundError:
+                    pass
+        return len(orphans)
@@ -0,0 +1,77 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from docengine.conversion import process_next_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process queued PDF-to-image conversion jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.CONVERSION_WORKER_CONCURRENCY,
+            help="Number of jobs processed at the same time.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        concurrency = options["concurrency"]
+        self.stdout.write(f"Starting conversion worker with concurrency {concurrency}")
+
+        if concurrency == 1:
+            self.work(options["poll_interval"], options["once"])
+            return
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(self.work, options["poll_interval"], options["once"])
+                for _ in range(concurrency)
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping after the jobs in progress")
+                self.stop.set()
+
+    def work(self, poll_interval, once):
+        threaded = threading.current_thread() is not threading.main_thread()
+        try:
+            while not self.stop.is_set():
+                try:
+                    job = process_next_job()
+                except Exception:
+                    # The job is queued again once it times out, keep processing
+                    # the others, after a pause in case the database is down.
+                    logger.exception("Conversion job failed")
+                    self.stop.wait(poll_interval)
+                    continue
+                if job is not None:
+                    self.stdout.write(f"Processed conversion job {job.id}")
+                elif once:
+                    return
+                else:
+                    self.stop.wait(poll_interval)
+        finally:
+            if threaded:
+                connection.close()
@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from docengine.models import Document
+from docengine.storage import document_upload_to, is_local_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the files of documents stored before the documents directory was "
+        "sharded to their sharded location."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of documents moved and updated per query.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of files moved in parallel.",
+        )
+
+    def handle(self, *args, **options):
+        storage = Document._meta.get_field("file").storage
+        if not is_local_storage(storage):
+            raise CommandError("Only local storages can be sharded.")
+        self.media_root = storage.path("")
+
+        batch_size = options["batch_size"]
+        moved = failed = 0
+        last_id = None
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                # Keyset pagination, the rows are updated as they are read.
+                documents = Document.objects.only("id", "file").order_by("id")
+                if last_id is not None:
+                    documents = documents.filter(id__gt=last_id)
+                batch = list(documents[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                batch = [
+                    document
+                    for document in batch
+                    if document.file.name != self.get_sharded_name(document)
+                ]
+                done, errors = self.move_batch(pool, batch)
+                moved, failed = moved + done, failed + errors
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {moved} documents, {failed} failed.")
+        )
+
+    def get_sharded_name(self, document):
+        return document_upload_to(document, os.path.basename(document.file.name))
+
+    def move_batch(self, pool, documents):
+        """
+        Move the files of a batch of documents in parallel, then save the new
+        names of the moved ones with one query. Return the number of documents
+        moved and failed.
+        """
+        moved = []
+        for document, error in zip(documents, pool.map(self.move_file, documents)):
+            if error:
+                self.stderr.write(f"Failed to move {document.file.name}: {error}")
+            else:
+                moved.append(document)
+        Document.objects.bulk_update(moved, ["file"])
+        return len(moved), len(documents) - len(moved)
+
+    def move_file(self, document):
+        """
+        Move the file of a document to its sharded name, which is set on the
+        document. Return an error message, or None.
+        """
+        name = self.get_sharded_name(document)
+        source = os.path.join(self.media_root, document.file.name)
+        target = os.path.join(self.media_root, name)
+        try:
+            if os.path.exists(target):
+                # Moved by an interrupted run, before the document was updated.
+                if os.path.exists(source):
+                    return "another file already has the sharded name"
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+        except OSError as e:
+            return str(e)
+        document.file.name = name
+        return None
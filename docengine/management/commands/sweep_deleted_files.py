@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from docengine.models import PendingFileDeletion
+
+
+class Command(BaseCommand):
+    help = "Delete the files of deleted documents from the storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of files deleted between two queries.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=60.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new deletions.",
+        )
+
+    def handle(self, *args, **options):
+        swept = 0
+        while True:
+            count = PendingFileDeletion.objects.sweep(options["batch_size"])
+            swept += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {swept} files."))
@@ -0,0 +1,108 @@
+from collections import Counter
+
+from PIL import Image as PilImage
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+from pypdf.generic import IndirectObject
+
+from docengine.imaging import EXIF_ORIENTATION_TAG
+from docengine.instrumentation import span
+
+
+@span("image.read_metadata")
+def read_image_metadata(file):
+    """
+    Return the width, height, number of channels, format, number of frames, EXIF
+    orientation and resolution of an image file.
+
+    Only the headers are read, the pixels are never decoded. Counting the
+    frames of animated images seeks through their frame headers.
+    """
+    with PilImage.open(file) as image:
+        width, height = image.size
+        dpi = image.info.get("dpi")
+        return {
+            "width": width,
+            "height": height,
+            "channels": len(image.getbands()),
+            "image_format": image.format,
+            "frame_count": getattr(image, "n_frames", 1),
+            "orientation": image.getexif().get(EXIF_ORIENTATION_TAG, 1),
+            "dpi": [round(float(value), 2) for value in dpi] if dpi else None,
+        }
+
+
+def iter_page_sizes(pdf_reader):
+    """
+    Yield the width and height of each page of a PDF, in order.
+
+    The page tree is walked directly, with the MediaBox inherited from parent
+    nodes, without building a pypdf page object for every page. Each page is
+    parsed when the walk reaches it and dropped from the reader's object cache
+    after, so memory does not grow with the number of pages.
+    """
+    stack = [(pdf_reader.trailer["/Root"].get_object()["/Pages"], None)]
+    # Nodes already walked, as a page tree pointing back to an ancestor would
+    # otherwise be walked forever.
+    visited = set()
+    while stack:
+        reference, mediabox = stack.pop()
+        if isinstance(reference, IndirectObject):
+            key = (reference.idnum, reference.generation)
+            if key in visited:
+                raise PdfReadError("Detected cyclic page references")
+            visited.add(key)
+        node = reference.get_object()
+        mediabox = node.get("/MediaBox", mediabox)
+        if node.get("/Type") == "/Pages":
+            kids = node.get("/Kids", [])
+            stack.extend((kid, mediabox) for kid in reversed(kids))
+            continue
+
+        if mediabox is None:
+            raise PdfReadError("Page without a MediaBox")
+        left, bottom, right, top = (float(value) for value in mediabox.get_object())
+        yield abs(right - left), abs(top - bottom)
+        if isinstance(reference, IndirectObject):
+            pdf_reader.resolved_objects.pop(
+                (reference.generation, reference.idnum), None
+            )
+
+
+def read_pdf_metadata(file):
+    """
+    Return the number of pages and the dimensions of every page of a PDF file.
+    """
+    pdf_reader = PdfReader(file)
+    page_dimensions = [
+        {"width": width, "height": height}
+        for width, height in iter_page_sizes(pdf_reader)
+    ]
+    return {
+        "num_pages": len(page_dimensions),
+        "page_dimensions": page_dimensions,
+    }
+
+
+def summarize_page_sizes(page_dimensions):
+    """
+    Return the distinct page sizes of a PDF, in order of first appearance, with
+    their number of pages.
+    """
+    counts = Counter(
+        (dimensions["width"], dimensions["height"]) for dimensions in page_dimensions
+    )
+    return [
+        {"width": width, "height": height, "count": count}
+        for (width, height), count in counts.items()
+    ]
+
+
+# Errors of the readers on files which do not decode, although their first bytes
+# identify them as images or PDFs.
+METADATA_ERRORS = (OSError, PdfReadError)
+
+METADATA_READERS = {
+    "image": read_image_metadata,
+    "pdf": read_pdf_metadata,
+}
@@ -0,0 +1,105 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:04
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0002_document_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversionJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                ("pages_done", models.PositiveIntegerField(default=0)),
+                ("pages_total", models.PositiveIntegerField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="conversion_jobs",
+                        to="docengine.document",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ConversionJobImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("page_number", models.PositiveIntegerField()),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="docengine.document",
+                    ),
+                ),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="docengine.conversionjob",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["page_number"],
+            },
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="images",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="+",
+                through="docengine.ConversionJobImage",
+                to="docengine.document",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="conversionjob",
+            index=models.Index(
+                fields=["status", "created_at"], name="docengine_c_status_e52ef7_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0003_conversion_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="options",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
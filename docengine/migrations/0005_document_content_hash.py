@@ -0,0 +1,25 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0004_conversion_job_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True, unique=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="ref_count",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0005_document_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Derivative",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "operation",
+                    models.CharField(
+                        choices=[("rotate", "Rotate"), ("convert", "Convert")],
+                        max_length=20,
+                    ),
+                ),
+                ("params", models.CharField(max_length=255)),
+                ("position", models.PositiveIntegerField(default=0)),
+                ("size", models.PositiveBigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "last_used_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "output",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="docengine.document",
+                    ),
+                ),
+                (
+                    "source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="derivatives",
+                        to="docengine.document",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["last_used_at"], name="docengine_d_last_us_35e897_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="derivative",
+            constraint=models.UniqueConstraint(
+                fields=("source", "operation", "params", "position"),
+                name="unique_derivative",
+            ),
+        ),
+    ]
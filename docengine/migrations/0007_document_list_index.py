@@ -0,0 +1,20 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0006_derivative"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                fields=["media_type", "-uploaded_at", "-id"],
+                name="document_type_uploaded_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0007_document_list_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(("media_type", "image")),
+                fields=["-uploaded_at", "-id"],
+                name="document_image_uploaded_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(("media_type", "pdf")),
+                fields=["-uploaded_at", "-id"],
+                name="document_pdf_uploaded_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(("media_type", "image")),
+                fields=["image_format", "-uploaded_at", "-id"],
+                name="document_image_format_idx",
+            ),
+        ),
+    ]
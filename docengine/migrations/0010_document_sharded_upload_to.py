@@ -0,0 +1,22 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+import docengine.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0009_pending_file_deletion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="document",
+            name="file",
+            field=models.FileField(
+                max_length=255, upload_to=docengine.storage.document_upload_to
+            ),
+        ),
+    ]
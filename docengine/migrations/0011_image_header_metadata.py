@@ -0,0 +1,28 @@
+# Generated by Django 4.2.17 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0010_document_sharded_upload_to"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="dpi",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="frame_count",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="orientation",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
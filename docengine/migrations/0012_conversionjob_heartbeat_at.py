@@ -0,0 +1,27 @@
+# Generated by Django 4.2.17 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+def set_heartbeat(apps, schema_editor):
+    # Jobs running before the heartbeat last showed progress when they started.
+    ConversionJob = apps.get_model("docengine", "ConversionJob")
+    ConversionJob.objects.filter(status="running").update(
+        heartbeat_at=models.F("started_at")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("docengine", "0011_image_header_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversionjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_heartbeat, migrations.RunPython.noop),
+    ]
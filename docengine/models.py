@@ -1,6 +1,156 @@
+import json
 import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from pathlib import PurePosixPath
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from docengine.instrumentation import span
+from docengine.metadata import METADATA_READERS
+from docengine.storage import (
+    delete_document_cache,
+    document_upload_to,
+    hash_file,
+    is_modified_since,
+    open_stream,
+    touch_file,
+)
+
+
+def get_detail_cache_key(document_id):
+    """
+    Return the cache key of the detail response of a document.
+    """
+    return f"docengine:document:{document_id}"
+
+
+class DocumentQuerySet(models.QuerySet):
+    def missing_metadata(self):
+        """
+        Return the documents whose metadata has not been extracted yet.
+        """
+        return self.filter(
+            models.Q(media_type="image", width__isnull=True)
+            | models.Q(media_type="image", frame_count__isnull=True)
+            | models.Q(media_type="pdf", num_pages__isnull=True)
+        )
+
+    def ingest(self, documents):
+        """
+        Save new documents whose files are already stored, reusing the existing
+        document instead of any whose content is already stored, and return the
+        saved documents in the order given.
+
+        Each reuse adds a reference to the existing document, so it is only
+        deleted once every upload of its content is deleted.
+        """
+        try:
+            with transaction.atomic():
+                return self._ingest(documents)
+        except IntegrityError:
+            # Another request stored the same content in the meantime, retry
+            # now that it is visible.
+            with transaction.atomic():
+                return self._ingest(documents)
+
+    def _ingest(self, documents):
+        existing = self.in_bulk(
+            {document.content_hash for document in documents},
+            field_name="content_hash",
+        )
+        new_documents = {}
+        reused = []
+        saved = []
+        for document in documents:
+            content_hash = document.content_hash
+            if content_hash in existing:
+                reused.append(existing[content_hash])
+                saved.append(existing[content_hash])
+            elif content_hash in new_documents:
+                new_documents[content_hash].ref_count += 1
+                saved.append(new_documents[content_hash])
+            else:
+                new_documents[content_hash] = document
+                saved.append(document)
+
+        self.add_references(reused)
+        self.bulk_create(new_documents.values())
+        return saved
+
+    def add_references(self, documents):
+        """
+        Add a reference to each saved document, once per occurrence.
+        """
+        document_ids = [document.id for document in documents]
+        for count, ids in group_by_count(document_ids).items():
+            self.filter(id__in=ids).update(ref_count=models.F("ref_count") + count)
+
+    def remove_references(self, document_ids):
+        """
+        Drop a reference to each document id, once per occurrence. The documents
+        left without references are deleted and their files queued for deletion.
+        Return the number of documents deleted.
+        """
+        groups = group_by_count(document_ids)
+        if not groups:
+            return 0
+
+        with transaction.atomic():
+            released = []
+            for count, ids in groups.items():
+                released += self.filter(id__in=ids, ref_count__lte=count).values_list(
+                    "id", flat=True
+                )
+                self.filter(id__in=ids, ref_count__gt=count).update(
+                    ref_count=models.F("ref_count") - count
+                )
+            if not released:
+                return 0
+            return self.filter(id__in=released).delete_with_files()
+
+    def delete_with_files(self):
+        """
+        Delete these documents, whatever their references, and queue their
+        files for deletion by the sweep_deleted_files command. Return the number
+        of documents deleted.
+        """
+        with transaction.atomic():
+            documents = list(self.values_list("id", "file"))
+            if not documents:
+                return 0
+
+            document_ids = [document_id for document_id, _ in documents]
+            # Derivatives are only kept for their source, drop their reference.
+            output_ids = list(
+                Derivative.objects.filter(source__in=document_ids).values_list(
+                    "output", flat=True
+                )
+            )
+            Document.objects.filter(id__in=document_ids).delete()
+            PendingFileDeletion.objects.bulk_create(
+                PendingFileDeletion(name=name, document_id=document_id)
+                for document_id, name in documents
+            )
+            Document.objects.remove_references(output_ids)
+            cache_keys = [
+                get_detail_cache_key(document_id) for document_id in document_ids
+            ]
+            transaction.on_commit(lambda: cache.delete_many(cache_keys))
+        return len(documents)
+
+
+def group_by_count(document_ids):
+    """
+    Return document ids grouped by their number of occurrences.
+    """
+    groups = defaultdict(list)
+    for document_id, count in Counter(document_ids).items():
+        groups[count].append(document_id)
+    return groups
 
 
 class Document(models.Model):
@@ -13,9 +163,502 @@ class Document(models.Model):
         ("pdf", "PDF"),
     ]
 
+    METADATA_FIELDS = [
+        "width",
+        "height",
+        "channels",
+        "image_format",
+        "frame_count",
+        "orientation",
+        "dpi",
+        "num_pages",
+        "page_dimensions",
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    file = models.FileField(upload_to="documents/")
+    file = models.FileField(upload_to=document_upload_to, max_length=255)
     media_type = models.CharField(
         max_length=20, choices=MEDIA_TYPE_CHOICES, blank=True, null=True
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # SHA-256 of the file, which is also its name in the storage.
+    content_hash = models.CharField(
+        max_length=64, unique=True, blank=True, null=True, editable=False
+    )
+    # Number of uploads sharing this document and its file.
+    ref_count = models.PositiveIntegerField(default=1, editable=False)
+
+    # Image metadata, extracted once when the file is ingested.
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    channels = models.PositiveSmallIntegerField(blank=True, null=True)
+    image_format = models.CharField(max_length=20, blank=True, null=True)
+    frame_count = models.PositiveIntegerField(blank=True, null=True)
+    # EXIF orientation, 1 when the image has none.
+    orientation = models.PositiveSmallIntegerField(blank=True, null=True)
+    # Horizontal and vertical resolution, when the image has one.
+    dpi = models.JSONField(blank=True, null=True)
+
+    # PDF metadata, extracted once when the file is ingested.
+    num_pages = models.PositiveIntegerField(blank=True, null=True)
+    page_dimensions = models.JSONField(blank=True, null=True)
+
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Paginated lists of a media type, newest first.
+            models.Index(
+                fields=["media_type", "-uploaded_at", "-id"],
+                name="document_type_uploaded_idx",
+            ),
+            # Smaller per media type indexes for the same lists, on the
+            # databases supporting partial indexes (PostgreSQL, SQLite).
+            models.Index(
+                fields=["-uploaded_at", "-id"],
+                condition=models.Q(media_type="image"),
+                name="document_image_uploaded_idx",
+            ),
+            models.Index(
+                fields=["-uploaded_at", "-id"],
+                condition=models.Q(media_type="pdf"),
+                name="document_pdf_uploaded_idx",
+            ),
+            # Image lists filtered by format.
+            models.Index(
+                fields=["image_format", "-uploaded_at", "-id"],
+                condition=models.Q(media_type="image"),
+                name="document_image_format_idx",
+            ),
+        ]
+
+    @property
+    def has_metadata(self):
+        if self.media_type == "image":
+            # The frame count was added later, images uploaded before lack it.
+            return self.width is not None and self.frame_count is not None
+        if self.media_type == "pdf":
+            return self.num_pages is not None
+        return True
+
+    @property
+    def display_size(self):
+        """
+        Return the width and height of an image as displayed, once its EXIF
+        orientation is applied.
+        """
+        # Orientations 5 to 8 are rotated by 90 or 270 degrees.
+        if self.orientation and self.orientation >= 5:
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def display_width(self):
+        return self.display_size[0]
+
+    @property
+    def display_height(self):
+        return self.display_size[1]
+
+    def extract_metadata(self):
+        """
+        Read the file and store its image/PDF metadata on this instance.
+        """
+        reader = METADATA_READERS.get(self.media_type)
+        if not reader:
+            return
+
+        if self.file._committed:
+            # Stored files are streamed, the readers only need a part of them.
+            with open_stream(self.file.storage, self.file.name) as file:
+                metadata = reader(file)
+        else:
+            self.file.open("rb")
+            try:
+                metadata = reader(self.file)
+            finally:
+                # Files that are not saved yet are still written by the storage
+                # backend afterwards, so only rewind them.
+                self.file.seek(0)
+
+        for field, value in metadata.items():
+            setattr(self, field, value)
+
+    def ensure_metadata(self):
+        """
+        Extract and persist the metadata of documents ingested before it was stored.
+        """
+        if not self.has_metadata:
+            self.extract_metadata()
+            self.save(update_fields=self.METADATA_FIELDS)
+
+    def prepare_file(self):
+        """
+        Extract the metadata and content hash of a new file and write it to the
+        storage, named after its content hash.
+        """
+        if not self.has_metadata:
+            self.extract_metadata()
+        if self.content_hash is None:
+            self.content_hash = hash_file(self.file)
+        if not self.file._committed:
+            self.store_file()
+
+    @span("storage.write")
+    def store_file(self):
+        """
+        Write the file to the storage under its content hash, unless a file with
+        the same content, and therefore the same name, is already stored.
+        """
+        extension = PurePosixPath(self.file.name).suffix.lower()
+        filename = f"{self.content_hash}{extension}"
+        name = self.file.field.generate_filename(self, filename)
+        # The file may be left by a deleted document, waiting for the sweeper,
+        # which keeps files touched since their deletion was queued.
+        if self.file.storage.exists(name) and touch_file(self.file.storage, name):
+            self.file.name = name
+            self.file._committed = True
+        else:
+            self.file.save(filename, self.file.file, save=False)
+            if self.file.name != name:
+                # The same content was stored concurrently and the storage
+                # picked another name for this copy, use the first one.
+                self.file.storage.delete(self.file.name)
+                self.file.name = name
+
+    def release(self):
+        """
+        Drop a reference to this document. The last one deletes the document and
+        its file. Return True if the document was deleted.
+        """
+        with transaction.atomic():
+            released = Document.objects.filter(id=self.id, ref_count__gt=1).update(
+                ref_count=models.F("ref_count") - 1
+            )
+            if released:
+                return False
+            self.delete_with_file()
+        return True
+
+    def delete_with_file(self):
+        """
+        Delete this document, whatever its references, and queue its files for
+        deletion.
+        """
+        Document.objects.filter(id=self.id).delete_with_files()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.content_hash is None:
+            self.prepare_file()
+        super().save(*args, **kwargs)
+
+
+class PendingFileDeletionQuerySet(models.QuerySet):
+    def sweep(self, batch_size=1000):
+        """
+        Delete the files of the oldest pending deletions, up to ``batch_size``,
+        along with the files generated from their documents. Files used by a
+        document again, after the same content was uploaded, are kept, as are
+        files touched since their deletion was queued, by an upload of the same
+        content not saved yet. Return the number of pending deletions processed.
+        """
+        pending = list(self.order_by("id")[:batch_size])
+        if not pending:
+            return 0
+
+        in_use = set(
+            Document.objects.filter(
+                file__in={deletion.name for deletion in pending}
+            ).values_list("file", flat=True)
+        )
+        storage = Document._meta.get_field("file").storage
+        for deletion in pending:
+            if deletion.name not in in_use and not is_modified_since(
+                storage, deletion.name, deletion.created_at
+            ):
+                storage.delete(deletion.name)
+            delete_document_cache(storage, deletion.document_id)
+        self.filter(id__in=[deletion.id for deletion in pending]).delete()
+        return len(pending)
+
+
+class PendingFileDeletion(models.Model):
+    """
+    The file of a deleted document, waiting to be deleted from the storage.
+    Deleting files is left to a background sweeper so that deletes only run
+    queries.
+    """
+
+    name = models.CharField(max_length=255)
+    document_id = models.UUIDField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PendingFileDeletionQuerySet.as_manager()
+
+
+class ConversionJob(models.Model):
+    """
+    A queued PDF-to-image conversion processed by the conversion worker.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="conversion_jobs"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    options = models.JSONField(default=dict, blank=True)
+    pages_done = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(blank=True, null=True)
+    images = models.ManyToManyField(
+        Document, through="ConversionJobImage", related_name="+", blank=True
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Updated as the pages are rendered, to tell running jobs from abandoned ones.
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    @classmethod
+    def requeue_stale(cls):
+        """
+        Queue again the running jobs without progress for CONVERSION_JOB_TIMEOUT
+        seconds, whose worker most likely stopped, and return their number.
+        """
+        cutoff = timezone.now() - timedelta(seconds=settings.CONVERSION_JOB_TIMEOUT)
+        return cls.objects.filter(status="running", heartbeat_at__lt=cutoff).update(
+            status="queued",
+            started_at=None,
+            heartbeat_at=None,
+            pages_done=0,
+            pages_total=None,
+        )
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Mark the oldest queued job as running and return it, or None if the
+        queue is empty. Safe to call from several workers at once. Stale
+        running jobs are queued again first.
+        """
+        cls.requeue_stale()
+        queued = cls.objects.filter(status="queued").order_by("created_at")
+        for job_id in queued.values_list("id", flat=True)[:10]:
+            now = timezone.now()
+            claimed = cls.objects.filter(id=job_id, status="queued").update(
+                status="running", started_at=now, heartbeat_at=now
+            )
+            if claimed:
+                return cls.objects.select_related("document").get(id=job_id)
+        return None
+
+    def held(self):
+        """
+        Return a queryset of this job while it is still running under this claim,
+        empty once it is deleted, or queued again and claimed by another worker.
+        """
+        return ConversionJob.objects.filter(
+            id=self.id, status="running", started_at=self.started_at
+        )
+
+    def ordered_images(self):
+        return self.images.order_by("conversionjobimage__page_number")
+
+
+class ConversionJobImage(models.Model):
+    """
+    An image produced by a conversion job, with the PDF page it was rendered from.
+    """
+
+    job = models.ForeignKey(ConversionJob, on_delete=models.CASCADE)
+    image = models.ForeignKey(Document, on_delete=models.CASCADE)
+    page_number = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ["page_number"]
+
+
+class DerivativeQuerySet(models.QuerySet):
+    def lookup(self, source, operation, params):
+        """
+        Return the outputs of an operation already applied to a source document
+        with the same parameters, in order, or None if there are none.
+        """
+        return self.lookup_many(operation, [(source, params)])[0]
+
+    def lookup_many(self, operation, requests):
+        """
+        Return the cached outputs for each (source, params) pair of
+        ``requests``, in order, or None for the pairs without outputs, with a
+        single query for all of them.
+        """
+        keys = [
+            (source.id, Derivative.normalize(params)) for source, params in requests
+        ]
+        derivatives = self.filter(
+            operation=operation,
+            source__in={source_id for source_id, _ in keys},
+            params__in={params for _, params in keys},
+        )
+        groups = defaultdict(list)
+        for derivative in derivatives.select_related("output").order_by("position"):
+            groups[(derivative.source_id, derivative.params)].append(derivative)
+
+        found = [groups[key] for key in keys if key in groups]
+        if not found:
+            return [None] * len(keys)
+
+        used = {derivative.id for group in found for derivative in group}
+        self.filter(id__in=used).update(last_used_at=timezone.now())
+        # Each request gets its own reference to the outputs.
+        Document.objects.add_references(
+            [derivative.output for group in found for derivative in group]
+        )
+        return [
+            [derivative.output for derivative in groups[key]] if key in groups else None
+            for key in keys
+        ]
+
+    def store(self, source, operation, params, outputs):
+        """
+        Remember the outputs of an operation on a source document, then evict the
+        least recently used derivatives if the cache grew over its maximum size.
+        """
+        self.store_many(operation, [(source, params, outputs)])
+
+    def store_many(self, operation, entries):
+        """
+        Remember the outputs of an operation for each (source, params, outputs)
+        entry with a single insert, then evict the least recently used
+        derivatives if the cache grew over its maximum size.
+        """
+        unique_entries = {}
+        for source, params, outputs in entries:
+            if any(output.id == source.id for output in outputs):
+                # The operation left the document unchanged.
+                continue
+            key = (source.id, Derivative.normalize(params))
+            unique_entries.setdefault(key, (source, outputs))
+        if not unique_entries:
+            return
+
+        try:
+            self._create_derivatives(operation, unique_entries)
+        except IntegrityError:
+            # A concurrent request stored some of the derivatives first.
+            if len(unique_entries) == 1:
+                return
+            for key, entry in unique_entries.items():
+                try:
+                    self._create_derivatives(operation, {key: entry})
+                except IntegrityError:
+                    pass
+        self.evict()
+
+    def _create_derivatives(self, operation, entries):
+        with transaction.atomic():
+            self.bulk_create(
+                Derivative(
+                    source=source,
+                    operation=operation,
+                    params=params,
+                    position=position,
+                    output=output,
+                    size=output.file.size,
+                )
+                for (_, params), (source, outputs) in entries.items()
+                for position, output in enumerate(outputs)
+            )
+            # The cache holds its own reference to the outputs.
+            Document.objects.add_references(
+                [output for _, outputs in entries.values() for output in outputs]
+            )
+
+    def evict(self, max_size=None):
+        """
+        Evict the least recently used derivatives until the files of the
+        remaining ones take at most ``max_size`` bytes. Return the number of
+        derivatives evicted.
+        """
+        if max_size is None:
+            max_size = settings.DERIVATIVE_CACHE_MAX_SIZE
+        total_size = self.aggregate(total_size=models.Sum("size"))["total_size"] or 0
+        if total_size <= max_size:
+            return 0
+
+        # The outputs of an operation are evicted together, a partial set of
+        # pages must never be served from the cache.
+        groups = (
+            self.values("source", "operation", "params")
+            .annotate(
+                group_last_used_at=models.Max("last_used_at"),
+                group_size=models.Sum("size"),
+            )
+            .order_by("group_last_used_at")
+        )
+        evicted = 0
+        for group in groups.iterator():
+            if total_size <= max_size:
+                break
+            derivatives = self.filter(
+                source=group["source"],
+                operation=group["operation"],
+                params=group["params"],
+            )
+            with transaction.atomic():
+                output_ids = list(derivatives.values_list("output", flat=True))
+                derivatives.delete()
+                Document.objects.remove_references(output_ids)
+            evicted += len(output_ids)
+            total_size -= group["group_size"]
+        return evicted
+
+
+class Derivative(models.Model):
+    """
+    An output of an operation on a document, kept so that repeating the same
+    operation with the same parameters returns it instead of computing it again.
+    """
+
+    OPERATION_CHOICES = [
+        ("rotate", "Rotate"),
+        ("convert", "Convert"),
+    ]
+
+    source = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="derivatives"
+    )
+    operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
+    # The operation parameters as canonical JSON.
+    params = models.CharField(max_length=255)
+    # Position of the output among the outputs of the operation, e.g. its page.
+    position = models.PositiveIntegerField(default=0)
+    output = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="+")
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    objects = DerivativeQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "operation", "params", "position"],
+                name="unique_derivative",
+            )
+        ]
+        indexes = [models.Index(fields=["last_used_at"])]
+
+    @staticmethod
+    def normalize(params):
+        return json.dumps(params, sort_keys=True, separators=(",", ":"))
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DocumentCursorPagination(CursorPagination):
+    """
+    Keyset pagination of documents, newest first.
+
+    The cursor encodes the position in the (uploaded_at, id) ordering, so each
+    page is an index range scan whatever its depth in the list.
+    """
+
+    ordering = ("-uploaded_at", "-id")
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
@@ -0,0 +1,47 @@
+from docengine.conversion import OUTPUT_EXTENSIONS, render_page_image
+from docengine.imaging import fit_size, render_thumbnail
+from docengine.storage import get_cached_file, get_local_path
+
+
+def get_rendition(document, width=None, height=None, fmt="webp"):
+    """
+    Return the storage name of a resized rendition of an image document,
+    generating it on the first request for this size and format.
+    """
+    document.ensure_metadata()
+    # Name the rendition after its actual size, so that requests with different
+    # bounds for the same result share the same file.
+    size = fit_size(
+        document.display_size,
+        (width or document.display_width, height or document.display_height),
+    )
+    name = f"renditions/{document.id}/{size[0]}x{size[1]}.{fmt}"
+
+    def generate():
+        document.file.open("rb")
+        try:
+            return render_thumbnail(document.file, size, fmt)
+        finally:
+            document.file.close()
+
+    return get_cached_file(document.file.storage, name, generate)
+
+
+def get_page_image(document, page, dpi=200, fmt="jpeg"):
+    """
+    Return the storage name of an image of a single page of a PDF document,
+    rendering it on the first request for this page, resolution and format.
+    Raise ValueError if the page does not exist.
+
+    Unlike conversions, the image is not a document, it is deleted with the PDF.
+    """
+    document.ensure_metadata()
+    if not 1 <= page <= document.num_pages:
+        raise ValueError(f"Invalid page number: {page}")
+    name = f"pages/{document.id}/{page}-{dpi}.{OUTPUT_EXTENSIONS[fmt]}"
+
+    def generate():
+        pdf_path = get_local_path(document.file.storage, document.file.name)
+        return render_page_image(pdf_path, page, dpi, fmt)
+
+    return get_cached_file(document.file.storage, name, generate)
@@ -0,0 +1,95 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from docengine.imaging import rotate_image
+from docengine.models import Derivative, Document
+
+
+def get_rotate_params(options):
+    """
+    Return the derivative cache parameters of a rotation.
+    """
+    return {**options, "rotation_angle": options["rotation_angle"] % 360}
+
+
+def rotate_document(document, options):
+    """
+    Rotate an image document and store the rotated image. Return it as an
+    unsaved image Document, to be saved with ``Document.objects.ingest()``.
+    """
+    # Open a file of its own, the same document may be rotated by other threads.
+    with document.file.storage.open(document.file.name, "rb") as file:
+        content, original_format = rotate_image(
+            file,
+            options["rotation_angle"],
+            resample=options["resample"],
+            fill_color=options["fill_color"],
+            exif_orientation=options["exif_orientation"],
+        )
+
+    rotated_image_name = f"{uuid.uuid4()}.{original_format.lower()}"
+    rotated_image = Document(
+        file=ContentFile(content, name=rotated_image_name), media_type="image"
+    )
+    rotated_image.prepare_file()
+    return rotated_image
+
+
+def rotate_documents(items, workers=None):
+    """
+    Rotate the image documents of a list of (document, options) pairs in a pool
+    of threads and save the rotated images together.
+
+    Return a list with, for each item in order, a pair of the rotated image or
+    None, and an error message or None. Rotations already in the derivative
+    cache are not computed again, and neither are repeated items.
+    """
+    workers = workers or settings.ROTATION_WORKERS
+    requests = [(document, get_rotate_params(options)) for document, options in items]
+    keys = [
+        (document.id, Derivative.normalize(params)) for document, params in requests
+    ]
+    cached = Derivative.objects.lookup_many("rotate", requests)
+
+    pending = {}
+    for key, (document, options), outputs in zip(keys, items, cached):
+        if outputs is None:
+            pending.setdefault(key, (document, options))
+
+    def rotate(item):
+        try:
+            return rotate_document(*item), None
+        except Exception as e:
+            return None, f"An error occurred while rotating the image: {e}"
+
+    if workers == 1 or len(pending) < 2:
+        rotated = [rotate(item) for item in pending.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            rotated = list(pool.map(rotate, pending.values()))
+    rotated = dict(zip(pending, rotated))
+
+    # Repeated items get the same rotated image, with a reference each.
+    new_images = [
+        rotated[key][0]
+        for key, outputs in zip(keys, cached)
+        if outputs is None and rotated[key][0]
+    ]
+    saved = iter(Document.objects.ingest(new_images))
+
+    results = []
+    entries = []
+    for key, (document, params), outputs in zip(keys, requests, cached):
+        if outputs is not None:
+            results.append((outputs[0], None))
+        elif rotated[key][0] is None:
+            results.append(rotated[key])
+        else:
+            image = next(saved)
+            results.append((image, None))
+            entries.append((document, params, [image]))
+    Derivative.objects.store_many("rotate", entries)
+    return results
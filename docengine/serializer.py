@@ -1,13 +1,41 @@
-import io
 from pathlib import Path
 
 import filetype
+from django.conf import settings
 from drf_extra_fields.fields import Base64FileField
-from PIL import Image as PilImage
-from pypdf import PdfReader
+from PIL import ImageColor
 from rest_framework import serializers
 
-from .models import Document
+from docengine.imaging import RENDITION_FORMATS, RESAMPLE_FILTERS
+from docengine.instrumentation import span
+from docengine.metadata import METADATA_ERRORS, summarize_page_sizes
+from docengine.tiles import TILE_FORMATS
+
+from .models import ConversionJob, Document
+
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "gif", "webp"]
+
+
+def extract_upload_metadata(document):
+    """
+    Read the metadata of an uploaded document. Raise ValidationError if its
+    file does not decode.
+    """
+    try:
+        document.extract_metadata()
+    except METADATA_ERRORS:
+        raise serializers.ValidationError("Invalid or corrupt file")
+
+
+def get_media_type(extension):
+    """
+    Return the document media type for a file extension.
+    """
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    if extension == "pdf":
+        return "pdf"
+    raise serializers.ValidationError(f"Unsupported file type: {extension}")
 
 
 class Base64FileFieldSerializer(Base64FileField):
@@ -29,7 +57,8 @@ class Base64FileFieldSerializer(Base64FileField):
 
     def to_internal_value(self, data):
         if isinstance(data, str):
-            return super().to_internal_value(data)
+            with span("upload.decode"):
+                return super().to_internal_value(data)
         return data
 
 
@@ -45,6 +74,67 @@ class DocumentSerializer(serializers.ModelSerializer):
         fields = ["id", "media_type", "location", "uploaded_at"]
 
 
+class DocumentFilterSerializer(serializers.Serializer):
+    """
+    Serializer to validate the query parameters filtering document lists.
+    """
+
+    uploaded_after = serializers.DateTimeField(required=False)
+    uploaded_before = serializers.DateTimeField(required=False)
+    # "format" is reserved by DRF for choosing the response renderer.
+    image_format = serializers.CharField(required=False)
+
+    def validate_image_format(self, value):
+        # Formats are stored as Pillow names them, in upper case, so that an
+        # exact match uses document_image_format_idx.
+        return value.upper()
+
+    def filter_queryset(self, queryset):
+        """
+        Return the documents of ``queryset`` matching the validated filters.
+        """
+        uploaded_after = self.validated_data.get("uploaded_after")
+        if uploaded_after:
+            queryset = queryset.filter(uploaded_at__gte=uploaded_after)
+        uploaded_before = self.validated_data.get("uploaded_before")
+        if uploaded_before:
+            queryset = queryset.filter(uploaded_at__lt=uploaded_before)
+        image_format = self.validated_data.get("image_format")
+        if image_format:
+            queryset = queryset.filter(image_format=image_format)
+        return queryset
+
+
+class DocumentBulkDeleteSerializer(DocumentFilterSerializer):
+    """
+    Serializer to validate the documents to delete at once, given by id or by
+    media type and list filters.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, allow_empty=False
+    )
+    media_type = serializers.ChoiceField(
+        choices=[choice for choice, _ in Document.MEDIA_TYPE_CHOICES], required=False
+    )
+
+    def validate(self, data):
+        if "ids" not in data and "media_type" not in data:
+            raise serializers.ValidationError(
+                "Either ids or a media_type to filter on is required."
+            )
+        return data
+
+    def filter_queryset(self, queryset):
+        ids = self.validated_data.get("ids")
+        if ids:
+            queryset = queryset.filter(id__in=ids)
+        media_type = self.validated_data.get("media_type")
+        if media_type:
+            queryset = queryset.filter(media_type=media_type)
+        return super().filter_queryset(queryset)
+
+
 class DocumentListSerializer(serializers.Serializer):
     """
     Serializer for handling multiple document uploads.
@@ -61,14 +151,13 @@ class DocumentListSerializer(serializers.Serializer):
             raise serializers.ValidationError("Please upload a valid file.")
 
         extension = Path(file.name).suffix.lower().lstrip(".")
-        if extension in ["jpg", "jpeg", "png", "gif", "webp"]:
-            media_type = "image"
-        elif extension == "pdf":
-            media_type = "pdf"
-        else:
-            raise serializers.ValidationError(f"Unsupported file type: {extension}")
+        media_type = get_media_type(extension)
 
         document = Document(file=file, media_type=media_type)
+        extract_upload_metadata(document)
+        # Documents are saved in bulk by Document.objects.ingest(), which
+        # bypasses save().
+        document.prepare_file()
         return document
 
     class Meta:
@@ -77,11 +166,9 @@ class DocumentListSerializer(serializers.Serializer):
 
 class ImageSerializer(serializers.ModelSerializer):
     location = serializers.CharField(source="file.url")
-    width = serializers.IntegerField(read_only=True)
-    height = serializers.IntegerField(read_only=True)
-    num_pages = serializers.IntegerField(read_only=True)
-    page_width = serializers.IntegerField(read_only=True)
-    page_height = serializers.IntegerField(read_only=True)
+    format = serializers.CharField(source="image_format", read_only=True)
+    display_width = serializers.IntegerField(read_only=True)
+    display_height = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Document
@@ -91,21 +178,23 @@ class ImageSerializer(serializers.ModelSerializer):
             "media_type",
             "width",
             "height",
-            "num_pages",
-            "page_width",
-            "page_height",
+            "channels",
+            "format",
+            "frame_count",
+            "orientation",
+            "dpi",
+            "display_width",
+            "display_height",
             "uploaded_at",
         ]
 
+    @span("serialize.image")
     def to_representation(self, instance):
         """
-        Customize the response depending on the file type (image or PDF).
+        Return the image metadata stored on the document at upload time.
         """
-        data = super().to_representation(instance)
-        image = PilImage.open(instance.file)
-        data["width"], data["height"] = image.size
-        data["channels"] = len(image.getbands())
-        return data
+        instance.ensure_metadata()
+        return super().to_representation(instance)
 
 
 class PdfSerializer(serializers.ModelSerializer):
@@ -114,10 +203,7 @@ class PdfSerializer(serializers.ModelSerializer):
     """
 
     location = serializers.CharField(source="file.url")
-    num_pages = serializers.IntegerField(read_only=True)
-    page_dimensions = serializers.ListField(
-        child=serializers.DictField(), read_only=True
-    )
+    page_sizes = serializers.SerializerMethodField()
 
     class Meta:
         model = Document
@@ -126,28 +212,44 @@ class PdfSerializer(serializers.ModelSerializer):
             "location",
             "num_pages",
             "page_dimensions",
+            "page_sizes",
             "uploaded_at",
         ]
 
-    def to_representation(self, instance):
+    def get_page_sizes(self, instance):
+        return summarize_page_sizes(instance.page_dimensions or [])
+
+    def get_page_dimensions_limit(self):
         """
-        Customize the response depending on the file type (image or PDF).
+        Return the maximum number of page dimensions to include, from the
+        ``page_dimensions_limit`` query parameter, or None for all of them.
         """
-        data = super().to_representation(instance)
-        pdf_file = instance.file.read()
-        pdf_reader = PdfReader(io.BytesIO(pdf_file))
-        data["num_pages"] = len(pdf_reader.pages)
-
-        page_dimensions = []
-        for page in pdf_reader.pages:
-            page_dimensions.append(
-                {
-                    "width": page.mediabox.width,
-                    "height": page.mediabox.height,
-                }
+        request = self.context.get("request")
+        value = request.GET.get("page_dimensions_limit") if request else None
+        if value is None:
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise serializers.ValidationError(
+                {"page_dimensions_limit": "Must be a non-negative integer."}
             )
+        return limit
 
-        data["page_dimensions"] = page_dimensions
+    @span("serialize.pdf")
+    def to_representation(self, instance):
+        """
+        Return the PDF metadata stored on the document at upload time. The page
+        dimensions can be capped, as large PDFs often have thousands of pages of
+        the same size, which ``page_sizes`` summarizes.
+        """
+        instance.ensure_metadata()
+        data = super().to_representation(instance)
+        limit = self.get_page_dimensions_limit()
+        if limit is not None and data["page_dimensions"]:
+            data["page_dimensions"] = data["page_dimensions"][:limit]
         return data
 
 
@@ -158,6 +260,28 @@ class RotateImageSerializer(serializers.Serializer):
 
     id = serializers.UUIDField(required=True)
     rotation_angle = serializers.FloatField(required=True)
+    resample = serializers.ChoiceField(
+        choices=list(RESAMPLE_FILTERS), default="nearest"
+    )
+    fill_color = serializers.CharField(default=None, allow_null=True)
+    exif_orientation = serializers.BooleanField(default=False)
+
+    def validate_fill_color(self, value):
+        if value is None:
+            return value
+        try:
+            ImageColor.getrgb(value)
+        except ValueError:
+            raise serializers.ValidationError(f"Invalid color: {value}")
+        return value
+
+    def get_options(self, data=None):
+        """
+        Return the rotation options given in the request, or in ``data``, one
+        validated item of a batch request.
+        """
+        data = self.validated_data if data is None else data
+        return {key: value for key, value in data.items() if key != "id"}
 
 
 class ConvertPdfToImageSerializer(serializers.Serializer):
@@ -166,3 +290,88 @@ class ConvertPdfToImageSerializer(serializers.Serializer):
     """
 
     id = serializers.UUIDField(required=True)
+    first_page = serializers.IntegerField(required=False, min_value=1)
+    last_page = serializers.IntegerField(required=False, min_value=1)
+    dpi = serializers.IntegerField(required=False, min_value=10, max_value=1200)
+    fmt = serializers.ChoiceField(required=False, choices=["jpeg", "png"])
+
+    def validate(self, data):
+        first_page = data.get("first_page", 1)
+        last_page = data.get("last_page")
+        if last_page is not None and last_page < first_page:
+            raise serializers.ValidationError(
+                "last_page must be greater than or equal to first_page."
+            )
+        return data
+
+    def get_options(self, data=None):
+        """
+        Return the conversion options given in the request, or in ``data``, one
+        validated item of a batch request.
+        """
+        data = self.validated_data if data is None else data
+        return {key: value for key, value in data.items() if key != "id"}
+
+
+class ConversionJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the status and result of a PDF-to-image conversion job.
+    """
+
+    images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ConversionJob
+        fields = [
+            "id",
+            "document",
+            "status",
+            "pages_done",
+            "pages_total",
+            "error",
+            "images",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+    def get_images(self, job):
+        if job.status != "done":
+            return []
+        return ImageSerializer(job.ordered_images(), many=True).data
+
+
+class RenditionSerializer(serializers.Serializer):
+    """
+    Serializer to validate the query parameters of an image rendition.
+    """
+
+    w = serializers.IntegerField(
+        required=False, min_value=1, max_value=settings.RENDITION_MAX_SIZE
+    )
+    h = serializers.IntegerField(
+        required=False, min_value=1, max_value=settings.RENDITION_MAX_SIZE
+    )
+    fmt = serializers.ChoiceField(choices=list(RENDITION_FORMATS), default="webp")
+
+    def validate(self, data):
+        if "w" not in data and "h" not in data:
+            raise serializers.ValidationError("Please provide w, h or both.")
+        return data
+
+
+class PageImageSerializer(serializers.Serializer):
+    """
+    Serializer to validate the query parameters of the image of a PDF page.
+    """
+
+    dpi = serializers.IntegerField(default=200, min_value=10, max_value=1200)
+    fmt = serializers.ChoiceField(choices=["jpeg", "png"], default="jpeg")
+
+
+class TileSerializer(serializers.Serializer):
+    """
+    Serializer to validate the query parameters of a tile.
+    """
+
+    fmt = serializers.ChoiceField(choices=TILE_FORMATS, default="jpeg")
@@ -0,0 +1,293 @@
+import hashlib
+import io
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+import uuid
+
+import filetype
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+# filetype identifies a file from its first 261 bytes.
+SNIFF_SIZE = 261
+
+# Directories of the files generated on demand from a document, such as
+# renditions/<document id>/256x256.webp. They are deleted with the document.
+DOCUMENT_CACHE_DIRECTORIES = ["renditions", "tiles", "pages"]
+
+# Number of directory levels, of two characters each, between the documents
+# directory and its files.
+SHARD_LEVELS = 2
+
+
+def document_upload_to(instance, filename):
+    """
+    Return the storage name of a document file, in a directory named after the
+    first characters of its file name, such as documents/ab/cd/abcd12....pdf.
+    File names are content hashes, which spreads the files evenly.
+    """
+    stem = os.path.basename(filename).lower()
+    shards = [stem[level * 2 : level * 2 + 2] for level in range(SHARD_LEVELS)]
+    return "/".join(["documents", *shards, os.path.basename(filename)])
+
+
+def read_chunks(stream, chunk_size=None):
+    """
+    Yield the content of a file-like object in fixed-size chunks.
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    return iter(lambda: stream.read(chunk_size), b"")
+
+
+def guess_extension(head):
+    """
+    Return the file extension guessed from the first bytes of a file, or None.
+    """
+    return filetype.guess_extension(head[:SNIFF_SIZE])
+
+
+def hash_file(file):
+    """
+    Return the SHA-256 hex digest of the content of a file.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def spool_upload(chunks):
+    """
+    Write a stream of chunks to a temporary file on disk and return it with
+    a generated name whose extension is sniffed from the first bytes, and the
+    SHA-256 hex digest of its content.
+
+    The storage backend moves temporary files into place instead of copying
+    them, so memory use is bounded by the chunk size whatever the file size.
+    """
+    spooled = TemporaryUploadedFile(
+        name="upload", content_type=None, size=0, charset=None
+    )
+    head = b""
+    sha256 = hashlib.sha256()
+    for chunk in chunks:
+        if len(head) < SNIFF_SIZE:
+            head += chunk[: SNIFF_SIZE - len(head)]
+        sha256.update(chunk)
+        spooled.write(chunk)
+        spooled.size += len(chunk)
+
+    spooled.seek(0)
+    extension = guess_extension(head)
+    spooled.name = f"{uuid.uuid4()}.{extension}"
+    return spooled, extension, sha256.hexdigest()
+
+
+def name_upload(uploaded):
+    """
+    Give an uploaded file a generated name whose extension is sniffed from
+    its first bytes and return that extension.
+    """
+    head = uploaded.read(SNIFF_SIZE)
+    uploaded.seek(0)
+    extension = guess_extension(head)
+    uploaded.name = f"{uuid.uuid4()}.{extension}"
+    return extension
+
+
+def get_cached_file(storage, name, generate):
+    """
+    Return ``name``, calling ``generate`` to produce the content of the file
+    and storing it the first time it is requested.
+    """
+    if storage.exists(name):
+        return name
+
+    saved_name = storage.save(name, ContentFile(generate()))
+    if saved_name != name:
+        # A concurrent request stored the same file first.
+        storage.delete(saved_name)
+    return name
+
+
+def is_local_storage(storage):
+    """
+    Return whether the files of a storage are on the local disk.
+    """
+    return isinstance(storage, FileSystemStorage)
+
+
+def touch_file(storage, name):
+    """
+    Set the modification time of a file of a local storage to now, so that the
+    sweeper and the reconcile_media command keep it, and return False if the
+    file was deleted in the meantime. Files of other storages are left as they
+    are.
+    """
+    if is_local_storage(storage):
+        # The time is given, the file system's own clock can be a few
+        # milliseconds behind the time the deletions are queued with.
+        now = time.time()
+        try:
+            os.utime(storage.path(name), (now, now))
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def is_modified_since(storage, name, when):
+    """
+    Return whether a file of a local storage was modified after ``when``.
+    """
+    if not is_local_storage(storage):
+        return False
+    try:
+        return storage.get_modified_time(name) > when
+    except FileNotFoundError:
+        return False
+
+
+class RangedObjectReader(io.RawIOBase):
+    """
+    A seekable read-only file over an object of an S3 bucket, which fetches the
+    parts that are read with ranged GET requests. PIL and pypdf only read a
+    part of most files to get their metadata.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.size = obj.content_length
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        last = min(self.position + len(buffer), self.size) - 1
+        response = self.obj.get(Range=f"bytes={self.position}-{last}")
+        data = response["Body"].read()
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_stream(storage, name):
+    """
+    Open a stored file for reading. Files of S3 storages are read in parts as
+    they are needed, instead of being downloaded whole when they are opened.
+    """
+    bucket = getattr(storage, "bucket", None)
+    if bucket is None:
+        return storage.open(name, "rb")
+    key = posixpath.join(storage.location, name) if storage.location else name
+    return io.BufferedReader(
+        RangedObjectReader(bucket.Object(key)),
+        buffer_size=settings.STORAGE_READ_BUFFER_SIZE,
+    )
+
+
+def get_local_path(storage, name):
+    """
+    Return a path on the local disk to a stored file, for tools that can only
+    read files from the disk, like poppler.
+
+    Files of remote storages are downloaded to a read-through cache in
+    ``STORAGE_CACHE_DIR``. Stored names are content hashes, so a cached file
+    never goes stale.
+    """
+    if is_local_storage(storage):
+        return storage.path(name)
+
+    path = os.path.join(settings.STORAGE_CACHE_DIR, name)
+    if os.path.exists(path):
+        # Mark the file as recently used for the eviction.
+        os.utime(path)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        with storage.open(name, "rb") as stored_file:
+            shutil.copyfileobj(stored_file, f, settings.UPLOAD_CHUNK_SIZE)
+    # Concurrent downloads of the same file replace each other atomically.
+    os.replace(f.name, path)
+    evict_local_cache(settings.STORAGE_CACHE_MAX_SIZE, keep=path)
+    return path
+
+
+def evict_local_cache(max_size, keep=None):
+    """
+    Delete the least recently used files of the read-through cache, except
+    ``keep``, until they take at most ``max_size`` bytes.
+    """
+    files = []
+    for directory, _, filenames in os.walk(settings.STORAGE_CACHE_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def delete_tree(storage, path):
+    """
+    Delete a directory of the storage and everything in it.
+    """
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+
+    for directory in directories:
+        delete_tree(storage, f"{path}/{directory}")
+    for filename in files:
+        storage.delete(f"{path}/{filename}")
+
+    try:
+        os.rmdir(storage.path(path))
+    except (NotImplementedError, OSError):
+        # Object storages have no directories to remove.
+        pass
+
+
+def delete_document_cache(storage, document_id):
+    """
+    Delete the files generated on demand from a document.
+    """
+    for directory in DOCUMENT_CACHE_DIRECTORIES:
+        delete_tree(storage, f"{directory}/{document_id}")
@@ -0,0 +1,204 @@
+"""
+Square tiles of images and PDF pages, for viewers loading large pages
+progressively.
+
+Tiles form a pyramid of zoom levels: at level 0 the whole page fits in one tile,
+and each level doubles the width and height of the page, up to the last level,
+where an image is at its full size and a PDF page at TILE_MAX_DPI. Tiles are
+TILE_SIZE pixels wide and high, except on the right and bottom edges, and are
+numbered from the top left corner.
+
+Only the area of the requested tile is decoded or rendered: poppler renders the
+region with its crop options, and JPEG images are decoded at a reduced scale
+before cropping. Tiles are stored on the first request and served from the
+storage afterwards.
+"""
+
+import math
+import subprocess
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+
+from docengine.imaging import RENDITION_FORMATS
+from docengine.instrumentation import span
+from docengine.storage import get_cached_file, get_local_path
+
+TILE_FORMATS = ["jpeg", "png"]
+
+# Errors of pdftoppm failing or missing, and of reading the document.
+TILE_ERRORS = (subprocess.CalledProcessError, OSError)
+
+
+def get_zoom_levels(width, height):
+    """
+    Return the number of zoom levels of a page of ``width`` by ``height``
+    pixels at full size.
+    """
+    largest = max(width, height, 1)
+    return max(math.ceil(math.log2(largest / settings.TILE_SIZE)), 0) + 1
+
+
+def get_level_size(width, height, zoom):
+    """
+    Return the width and height of a page at a zoom level, and the scale of
+    that level relative to the full size.
+    """
+    scale = 2.0 ** (zoom - get_zoom_levels(width, height) + 1)
+    return max(math.ceil(width * scale), 1), max(math.ceil(height * scale), 1), scale
+
+
+def get_tile_box(width, height, zoom, x, y):
+    """
+    Return the (left, top, right, bottom) box of a tile in a page of ``width`` by
+    ``height`` pixels at full size, in pixels of its zoom level, and the scale
+    of the level. Raise ValueError if the tile does not exist.
+    """
+    if not 0 <= zoom < get_zoom_levels(width, height):
+        raise ValueError(f"Invalid zoom level: {zoom}")
+
+    level_width, level_height, scale = get_level_size(width, height, zoom)
+    tile_size = settings.TILE_SIZE
+    left, top = x * tile_size, y * tile_size
+    if x < 0 or y < 0 or left >= level_width or top >= level_height:
+        raise ValueError(f"Invalid tile: {x}/{y}")
+
+    right = min(left + tile_size, level_width)
+    bottom = min(top + tile_size, level_height)
+    return (left, top, right, bottom), scale
+
+
+def get_tiles_info(width, height):
+    """
+    Return the description of the tile pyramid of a page, for viewers.
+    """
+    return {
+        "width": width,
+        "height": height,
+        "tile_size": settings.TILE_SIZE,
+        "levels": get_zoom_levels(width, height),
+    }
+
+
+def get_image_size(document, page):
+    """
+    Return the full size, in pixels, of an image document, which has a single
+    page. Raise ValueError for other pages.
+    """
+    if page != 1:
+        raise ValueError(f"Invalid page number: {page}")
+    document.ensure_metadata()
+    return document.width, document.height
+
+
+def get_pdf_page_size(document, page):
+    """
+    Return the full size, in pixels at TILE_MAX_DPI, of a page of a PDF
+    document. Raise ValueError if the page does not exist.
+    """
+    document.ensure_metadata()
+    if not 1 <= page <= document.num_pages:
+        raise ValueError(f"Invalid page number: {page}")
+    dimensions = document.page_dimensions[page - 1]
+    scale = settings.TILE_MAX_DPI / 72
+    return round(dimensions["width"] * scale), round(dimensions["height"] * scale)
+
+
+@span("image.tile")
+def render_image_tile(file, box, scale, fmt="jpeg"):
+    """
+    Return the tile of an image within ``box``, in pixels of a zoom level of
+    ``scale``, encoded in ``fmt``.
+    """
+    with Image.open(file) as image:
+        width, height = image.size
+        left, top, right, bottom = box
+        tile_size = (right - left, bottom - top)
+        # JPEG images are decoded at the smallest reduced scale still larger
+        # than the zoom level, which changes the size of the image.
+        image.draft(image.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+        ratio = image.size[0] / width / scale
+        region = image.crop(
+            (
+                round(left * ratio),
+                round(top * ratio),
+                min(round(right * ratio), image.size[0]),
+                min(round(bottom * ratio), image.size[1]),
+            )
+        )
+        if region.size != tile_size:
+            region = region.resize(tile_size, Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and region.mode not in ("RGB", "L"):
+            region = region.convert("RGB")
+
+        image_io = BytesIO()
+        region.save(image_io, format=RENDITION_FORMATS[fmt])
+    return image_io.getvalue()
+
+
+@span("pdf.tile")
+def render_pdf_tile(pdf_path, page, box, dpi, fmt="jpeg"):
+    """
+    Return the tile of a PDF page within ``box``, in pixels of the page at
+    ``dpi``, encoded in ``fmt``. poppler only renders the tile's area.
+    """
+    left, top, right, bottom = box
+    command = [
+        "pdftoppm",
+        f"-{fmt}",
+        "-singlefile",
+        "-f",
+        str(page),
+        "-l",
+        str(page),
+        "-r",
+        f"{dpi:g}",
+        "-x",
+        str(left),
+        "-y",
+        str(top),
+        "-W",
+        str(right - left),
+        "-H",
+        str(bottom - top),
+        str(pdf_path),
+    ]
+    # Without an output file, pdftoppm writes the image to its standard output.
+    return subprocess.run(command, capture_output=True, check=True).stdout
+
+
+def get_image_tile(document, page, zoom, x, y, fmt="jpeg"):
+    """
+    Return the storage name of a tile of an image document, generating it on
+    the first request. Raise ValueError if the tile does not exist.
+    """
+    width, height = get_image_size(document, page)
+    box, scale = get_tile_box(width, height, zoom, x, y)
+    name = f"tiles/{document.id}/{zoom}/{x}_{y}.{fmt}"
+
+    def generate():
+        document.file.open("rb")
+        try:
+            return render_image_tile(document.file, box, scale, fmt)
+        finally:
+            document.file.close()
+
+    return get_cached_file(document.file.storage, name, generate)
+
+
+def get_pdf_tile(document, page, zoom, x, y, fmt="jpeg"):
+    """
+    Return the storage name of a tile of a page of a PDF document, generating
+    it on the first request. Raise ValueError if the tile does not exist.
+    """
+    width, height = get_pdf_page_size(document, page)
+    box, scale = get_tile_box(width, height, zoom, x, y)
+    name = f"tiles/{document.id}/{page}/{zoom}/{x}_{y}.{fmt}"
+
+    def generate():
+        storage = document.file.storage
+        pdf_path = get_local_path(storage, document.file.name)
+        return render_pdf_tile(pdf_path, page, box, settings.TILE_MAX_DPI * scale, fmt)
+
+    return get_cached_file(document.file.storage, name, generate)
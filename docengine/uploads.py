@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from docengine.serializer import DocumentListSerializer
+
+
+def prepare_upload(item):
+    """
+    Decode, validate and store one item of a Base64 batch upload. Return the
+    unsaved Document, or raise ValidationError.
+    """
+    serializer = DocumentListSerializer(data=item)
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+def prepare_uploads(items, workers=None):
+    """
+    Prepare the items of a Base64 batch upload in a pool of threads.
+
+    Return a list with, for each item in order, a pair of the unsaved Document
+    or None, and the validation errors of the item or None. The documents are
+    then saved together with ``Document.objects.ingest()``.
+    """
+    workers = workers or settings.UPLOAD_WORKERS
+
+    def prepare(item):
+        try:
+            return prepare_upload(item), None
+        except ValidationError as e:
+            return None, e.detail
+
+    if workers == 1 or len(items) < 2:
+        return [prepare(item) for item in items]
+
+    # Hashing, image decoding and file writes release the GIL.
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(prepare, items))
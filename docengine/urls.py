@@ -17,18 +17,37 @@ Including another URLconf
 
 from django.urls import path
 
+from docengine.async_views import (
+    AsyncDocumentUploadView,
+    AsyncImageListView,
+    AsyncImageRetrieveDeleteView,
+    AsyncPdfListView,
+    AsyncPdfRetrieveDeleteView,
+)
 from docengine.views import (
+    ConversionJobCreateView,
+    ConversionJobRetrieveView,
+    ConvertPdfToImageBatchView,
     ConvertPdfToImageView,
+    DocumentBulkDeleteView,
+    DocumentDownloadView,
+    DocumentStreamUploadView,
     DocumentUploadView,
     ImageListView,
+    ImageRenditionView,
     ImageRetrieveDeleteView,
+    ImageTileView,
     PdfListView,
+    PdfPageImageView,
     PdfRetrieveDeleteView,
+    PdfTileView,
+    RotateImageBatchView,
     RotateImageView,
 )
 
 urlpatterns = [
     path("upload/", DocumentUploadView.as_view(), name="upload"),
+    path("upload/stream/", DocumentStreamUploadView.as_view(), name="upload-stream"),
     path("images/", ImageListView.as_view(), name="images-list"),
     path("pdfs/", PdfListView.as_view(), name="pdfs-list"),
     path(
@@ -39,10 +58,76 @@ urlpatterns = [
     path(
         "pdfs/<uuid:id>/", PdfRetrieveDeleteView.as_view(), name="pdf-retrieve-delete"
     ),
+    path(
+        "documents/delete/",
+        DocumentBulkDeleteView.as_view(),
+        name="documents-bulk-delete",
+    ),
+    path(
+        "documents/<uuid:id>/download/",
+        DocumentDownloadView.as_view(),
+        name="document-download",
+    ),
+    path(
+        "images/<uuid:id>/rendition/",
+        ImageRenditionView.as_view(),
+        name="image-rendition",
+    ),
+    path("images/<uuid:id>/tiles/", ImageTileView.as_view(), name="image-tiles"),
+    path(
+        "images/<uuid:id>/tiles/<int:zoom>/<int:x>/<int:y>/",
+        ImageTileView.as_view(),
+        name="image-tile",
+    ),
+    path(
+        "pdfs/<uuid:id>/pages/<int:page>/image/",
+        PdfPageImageView.as_view(),
+        name="pdf-page-image",
+    ),
+    path(
+        "pdfs/<uuid:id>/pages/<int:page>/tiles/",
+        PdfTileView.as_view(),
+        name="pdf-page-tiles",
+    ),
+    path(
+        "pdfs/<uuid:id>/pages/<int:page>/tiles/<int:zoom>/<int:x>/<int:y>/",
+        PdfTileView.as_view(),
+        name="pdf-page-tile",
+    ),
     path("rotate/", RotateImageView.as_view(), name="image-rotate"),
+    path("rotate/batch/", RotateImageBatchView.as_view(), name="image-rotate-batch"),
     path(
         "convert-pdf-to-image/",
         ConvertPdfToImageView.as_view(),
         name="convert-pdf-to-image",
     ),
+    path(
+        "convert-pdf-to-image/batch/",
+        ConvertPdfToImageBatchView.as_view(),
+        name="convert-pdf-to-image-batch",
+    ),
+    path(
+        "convert-pdf-to-image/jobs/",
+        ConversionJobCreateView.as_view(),
+        name="conversion-job-create",
+    ),
+    path(
+        "convert-pdf-to-image/jobs/<uuid:id>/",
+        ConversionJobRetrieveView.as_view(),
+        name="conversion-job-detail",
+    ),
+    # Async variants of the document endpoints, for ASGI deployments.
+    path("async/upload/", AsyncDocumentUploadView.as_view(), name="async-upload"),
+    path("async/images/", AsyncImageListView.as_view(), name="async-images-list"),
+    path("async/pdfs/", AsyncPdfListView.as_view(), name="async-pdfs-list"),
+    path(
+        "async/images/<uuid:id>/",
+        AsyncImageRetrieveDeleteView.as_view(),
+        name="async-image-retrieve-delete",
+    ),
+    path(
+        "async/pdfs/<uuid:id>/",
+        AsyncPdfRetrieveDeleteView.as_view(),
+        name="async-pdf-retrieve-delete",
+    ),
 ]
@@ -1,87 +1,472 @@
-import uuid
-from io import BytesIO
-
-from django.core.files.base import ContentFile
-from django.core.files.uploadedfile import SimpleUploadedFile
-from pdf2image import convert_from_path
-from PIL import Image
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from rest_framework import status
-from rest_framework.generics import ListAPIView, RetrieveDestroyAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView, RetrieveAPIView, RetrieveDestroyAPIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from docengine.conversion import (
+    RENDER_ERRORS,
+    convert_pdf_to_images,
+    convert_pdfs_to_images,
+    get_page_range,
+)
+from docengine.delivery import get_detail_cache_policy, serve_file
+from docengine.pagination import DocumentCursorPagination
+from docengine.renditions import get_page_image, get_rendition
+from docengine.rotation import rotate_documents
 from docengine.serializer import (
+    ConversionJobSerializer,
     ConvertPdfToImageSerializer,
-    DocumentListSerializer,
+    DocumentBulkDeleteSerializer,
+    DocumentFilterSerializer,
     DocumentSerializer,
     ImageSerializer,
+    PageImageSerializer,
     PdfSerializer,
+    RenditionSerializer,
     RotateImageSerializer,
+    TileSerializer,
+    extract_upload_metadata,
+    get_media_type,
 )
+from docengine.storage import name_upload, read_chunks, spool_upload
+from docengine.tiles import (
+    TILE_ERRORS,
+    get_image_size,
+    get_image_tile,
+    get_pdf_page_size,
+    get_pdf_tile,
+    get_tiles_info,
+)
+from docengine.uploads import prepare_uploads
+
+from .models import ConversionJob, Document, get_detail_cache_key
 
-from .models import Document
+
+def get_batch_response(results):
+    """
+    Return the response to a batch request from its results in request order,
+    a failure only if every item failed.
+    """
+    if all("error" in result for result in results):
+        return Response({"results": results}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"results": results}, status=status.HTTP_201_CREATED)
 
 
 class DocumentUploadView(APIView):
     """
     API endpoint for uploading multiple documents.
+
+    The files are decoded, validated and stored in parallel. Invalid items are
+    reported with their index and do not prevent the valid ones from being
+    saved, unless all of them are invalid.
     """
 
     def post(self, request, *args, **kwargs):
-        serializer = DocumentListSerializer(data=request.data, many=True)
-        if serializer.is_valid():
-            documents = serializer.save()
-
-            Document.objects.bulk_create(documents)
-            return Response(
-                {
-                    "message": "Documents uploaded successfully",
-                    "documents": [doc.id for doc in documents],
-                },
-                status=status.HTTP_201_CREATED,
-            )
-        else:
+        if not isinstance(request.data, list):
             return Response(
-                {"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+                {"error": "Expected a list of files."},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
+        results = prepare_uploads(request.data)
+        errors = {index: error for index, (_, error) in enumerate(results) if error}
+        if errors and len(errors) == len(results):
+            return Response({"error": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        documents = Document.objects.ingest(
+            [document for document, _ in results if document]
+        )
+        response = {
+            "message": "Documents uploaded successfully",
+            "documents": [doc.id for doc in documents],
+        }
+        if errors:
+            response["errors"] = errors
+        return Response(response, status=status.HTTP_201_CREATED)
+
 
-class ImageListView(ListAPIView):
+class DocumentStreamUploadView(APIView):
     """
-    API endpoint for retrieving a list of all uploaded images.
+    API endpoint for uploading documents as raw binary instead of Base64.
+
+    Accepts either a multipart form with one or more ``file`` parts, or a single
+    file sent as the ``application/octet-stream`` request body. The body is
+    written to disk in fixed-size chunks and never held in memory as a whole.
     """
 
-    queryset = Document.objects.filter(media_type="image")
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            if request.content_type.startswith("multipart/form-data"):
+                files = self.get_multipart_files(request)
+            elif request.content_type == "application/octet-stream":
+                files = [self.get_stream_file(request)]
+            else:
+                return Response(
+                    {"error": f"Unsupported content type: {request.content_type}"},
+                    status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                )
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            documents = [
+                Document(file=file, media_type=media_type, content_hash=content_hash)
+                for file, media_type, content_hash in files
+            ]
+            # Every file is read before any is stored, so that a corrupt file
+            # does not leave the others in the storage.
+            for document in documents:
+                extract_upload_metadata(document)
+            for document in documents:
+                document.prepare_file()
+
+            documents = Document.objects.ingest(documents)
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            # Temporary files moved into the storage are already gone.
+            for file, _, _ in files:
+                file.close()
+
+        return Response(
+            {
+                "message": "Documents uploaded successfully",
+                "documents": [doc.id for doc in documents],
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    def get_multipart_files(self, request):
+        """
+        Return the uploaded ``file`` parts, which Django's upload handlers have
+        already streamed to temporary files, with their media types.
+        Their content hashes are computed when they are stored.
+        """
+        uploaded_files = request.FILES.getlist("file")
+        if not uploaded_files:
+            raise ValidationError("Please upload a valid file.")
+
+        files = []
+        for uploaded in uploaded_files:
+            extension = name_upload(uploaded)
+            files.append((uploaded, get_media_type(extension), None))
+        return files
+
+    def get_stream_file(self, request):
+        """
+        Spool the raw request body to a temporary file and return it with its
+        media type and content hash.
+        """
+        if request.stream is None:
+            raise ValidationError("Please upload a valid file.")
+
+        file, extension, content_hash = spool_upload(read_chunks(request.stream))
+        return file, get_media_type(extension), content_hash
+
+
+class DocumentListView(ListAPIView):
+    """
+    Base API endpoint for paginated lists of documents of one media type.
+    """
+
+    media_type = None
     serializer_class = DocumentSerializer
+    pagination_class = DocumentCursorPagination
+
+    def get_queryset(self):
+        filters = DocumentFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        queryset = Document.objects.filter(media_type=self.media_type).only(
+            "id", "media_type", "file", "uploaded_at"
+        )
+        return filters.filter_queryset(queryset)
 
 
-class PdfListView(ListAPIView):
+class ImageListView(DocumentListView):
+    """
+    API endpoint for retrieving a list of all uploaded images.
+    """
+
+    media_type = "image"
+
+
+class PdfListView(DocumentListView):
     """
     API endpoint for retrieving a list of all uploaded PDFs.
     """
 
-    queryset = Document.objects.filter(media_type="pdf")
-    serializer_class = DocumentSerializer
+    media_type = "pdf"
+
 
+class DocumentRetrieveDeleteView(RetrieveDestroyAPIView):
+    """
+    Base API view to retrieve or delete a document.
+
+    Documents do not change once uploaded, so their details are cached by id
+    until they are deleted, and sent with a strong ETag and a long-lived
+    Cache-Control header. A request whose If-None-Match matches the cached
+    ETag is answered with a 304 without any query. Requests with query
+    parameters are not cached.
+    """
+
+    lookup_field = "id"
+
+    def retrieve(self, request, *args, **kwargs):
+        storage = Document._meta.get_field("file").storage
+        cache_control, timeout = get_detail_cache_policy(storage)
+        key = None if request.query_params else get_detail_cache_key(kwargs["id"])
+        cached = cache.get(key) if key else None
+        # The view of another media type must answer with a 404.
+        if cached and cached["view"] == self.__class__.__name__:
+            data, etag = cached["data"], cached["etag"]
+        else:
+            data = self.get_serializer(self.get_object()).data
+            content = json.dumps(data, sort_keys=True, default=str)
+            etag = f'"{hashlib.sha256(content.encode()).hexdigest()[:32]}"'
+            if key:
+                cached = {"view": self.__class__.__name__, "data": data, "etag": etag}
+                cache.set(key, cached, timeout)
+
+        response = get_conditional_response(request, etag=etag) or Response(data)
+        response["ETag"] = etag
+        response["Cache-Control"] = cache_control
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    def perform_destroy(self, instance):
+        # Documents are shared by every upload of the same content, only the
+        # last delete removes the document and its file.
+        instance.release()
+
+
+class DocumentBulkDeleteView(APIView):
+    """
+    API endpoint for deleting many documents at once, given by id or by media
+    type and list filters.
+
+    Each document loses one reference, like with a single delete. Documents left
+    without references are deleted with a few queries per batch, and their
+    files are deleted later by the sweep_deleted_files command.
+    """
+
+    # Documents deleted per transaction, which keeps the id lists of the queries
+    # within database limits.
+    batch_size = 1000
+
+    def post(self, request):
+        serializer = DocumentBulkDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ImageRetrieveDeleteView(RetrieveDestroyAPIView):
+        document_ids = list(
+            serializer.filter_queryset(Document.objects.all()).values_list(
+                "id", flat=True
+            )
+        )
+        deleted = 0
+        for start in range(0, len(document_ids), self.batch_size):
+            deleted += Document.objects.remove_references(
+                document_ids[start : start + self.batch_size]
+            )
+        return Response(
+            {"released": len(document_ids), "deleted": deleted},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ImageRetrieveDeleteView(DocumentRetrieveDeleteView):
     """
     API view to retrieve or delete an image document.
     """
 
     queryset = Document.objects.filter(media_type="image")
     serializer_class = ImageSerializer
-    lookup_field = "id"
 
 
-class PdfRetrieveDeleteView(RetrieveDestroyAPIView):
+class PdfRetrieveDeleteView(DocumentRetrieveDeleteView):
     """
     API view to retrieve or delete an pdf document.
     """
 
     queryset = Document.objects.filter(media_type="pdf")
     serializer_class = PdfSerializer
-    lookup_field = "id"
+
+
+class DocumentDownloadView(APIView):
+    def get(self, request, id):
+        """
+        Returns the file of a document, including the images produced by
+        rotations and conversions. Supports conditional and range requests.
+        """
+        try:
+            document = Document.objects.only(
+                "id", "file", "content_hash", "uploaded_at"
+            ).get(id=id)
+        except Document.DoesNotExist:
+            return Response(
+                {"error": "Document not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        return serve_file(
+            request,
+            document.file.storage,
+            document.file.name,
+            etag=f'"{document.content_hash or document.id}"',
+            last_modified=document.uploaded_at,
+        )
+
+
+class ImageRenditionView(APIView):
+    def get(self, request, id):
+        """
+        Returns a resized rendition of an image, generated on the first
+        request for that size and format and served from the media storage
+        afterwards.
+        """
+        try:
+            document = Document.objects.get(id=id, media_type="image")
+        except Document.DoesNotExist:
+            return Response(
+                {"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = RenditionSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        name = get_rendition(
+            document,
+            width=serializer.validated_data.get("w"),
+            height=serializer.validated_data.get("h"),
+            fmt=serializer.validated_data["fmt"],
+        )
+        storage = document.file.storage
+        return serve_file(
+            request,
+            storage,
+            name,
+            etag=f'"{document.content_hash}-{os.path.basename(name)}"',
+            last_modified=storage.get_modified_time(name),
+        )
+
+
+class PdfPageImageView(APIView):
+    def get(self, request, id, page):
+        """
+        Returns an image of a single page of a PDF, rendered on the first
+        request for this page, resolution and format and served from the media
+        storage afterwards. No image document is created.
+        """
+        try:
+            document = Document.objects.get(id=id, media_type="pdf")
+        except Document.DoesNotExist:
+            return Response(
+                {"error": "PDF document not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = PageImageSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            name = get_page_image(document, page, **serializer.validated_data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except RENDER_ERRORS as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        storage = document.file.storage
+        return serve_file(
+            request,
+            storage,
+            name,
+            etag=f'"{document.content_hash}-{page}-{os.path.basename(name)}"',
+            last_modified=storage.get_modified_time(name),
+        )
+
+
+class TileView(APIView):
+    """
+    Base API view for the tiles of the pages of a document.
+    """
+
+    media_type = None
+    # Functions returning the full size of a page of a document, in pixels, and
+    # the storage name of a tile of a page, from the tiles module.
+    get_page_size = None
+    get_tile = None
+
+    def get_document(self, id):
+        return Document.objects.get(id=id, media_type=self.media_type)
+
+    def get(self, request, id, page=1, zoom=None, x=None, y=None):
+        """
+        Returns a tile of a page, or the description of the tiles of the page
+        without ``zoom``, ``x`` and ``y``.
+        """
+        try:
+            document = self.get_document(id)
+        except Document.DoesNotExist:
+            return Response(
+                {"error": "Document not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = TileSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        fmt = serializer.validated_data["fmt"]
+
+        try:
+            if zoom is None:
+                return Response(get_tiles_info(*self.get_page_size(document, page)))
+            name = self.get_tile(document, page, zoom, x, y, fmt)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except TILE_ERRORS as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        storage = document.file.storage
+        return serve_file(
+            request,
+            storage,
+            name,
+            etag=f'"{document.content_hash}-{page}-{zoom}-{x}-{y}.{fmt}"',
+            last_modified=storage.get_modified_time(name),
+        )
+
+
+class ImageTileView(TileView):
+    """
+    API view for the tiles of an image.
+    """
+
+    media_type = "image"
+    get_page_size = staticmethod(get_image_size)
+    get_tile = staticmethod(get_image_tile)
+
+
+class PdfTileView(TileView):
+    """
+    API view for the tiles of the pages of a PDF, rendered at up to
+    TILE_MAX_DPI.
+    """
+
+    media_type = "pdf"
+    get_page_size = staticmethod(get_pdf_page_size)
+    get_tile = staticmethod(get_pdf_tile)
 
 
 class RotateImageView(APIView):
@@ -103,33 +488,58 @@ class RotateImageView(APIView):
                 {"error": "Image not found."}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        rotation_angle = serializer.validated_data["rotation_angle"]
-
-        try:
-            image = Image.open(document.file)
-            rotated_image = image.rotate(rotation_angle, expand=True)
-            original_format = image.format
+        [(rotated_image, error)] = rotate_documents(
+            [(document, serializer.get_options())]
+        )
+        if error:
+            return Response(
+                {"errors": error}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response(
+            ImageSerializer(rotated_image).data, status=status.HTTP_201_CREATED
+        )
 
-            image_io = BytesIO()
-            rotated_image.save(image_io, format=original_format)
-            image_io.seek(0)
 
-            rotated_image_name = f"{uuid.uuid4()}.{original_format.lower()}"
-            rotated_image_file = ContentFile(image_io.read(), name=rotated_image_name)
+class RotateImageBatchView(APIView):
+    def post(self, request):
+        """
+        Accepts a list of image IDs and rotation options, rotates the images in
+        parallel, and returns the results in request order, either a rotated
+        image or an error.
+        """
+        serializer = RotateImageSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.BATCH_MAX_ITEMS,
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            rotated_image = Document.objects.create(
-                file=rotated_image_file,
-                media_type="image",
+        items = serializer.validated_data
+        documents = Document.objects.filter(media_type="image").in_bulk(
+            {item["id"] for item in items}
+        )
+        rotated = iter(
+            rotate_documents(
+                [
+                    (documents[item["id"]], serializer.child.get_options(item))
+                    for item in items
+                    if item["id"] in documents
+                ]
             )
+        )
 
-            document_serializer = ImageSerializer(rotated_image)
-            return Response(document_serializer.data, status=status.HTTP_201_CREATED)
-
-        except Exception as e:
-            return Response(
-                {"errors": f"An error occurred while rotating the image: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        results = []
+        for item in items:
+            if item["id"] not in documents:
+                results.append({"error": "Image not found."})
+                continue
+            rotated_image, error = next(rotated)
+            results.append(
+                {"error": error} if error else ImageSerializer(rotated_image).data
             )
+        return get_batch_response(results)
 
 
 class ConvertPdfToImageView(APIView):
@@ -150,30 +560,104 @@ class ConvertPdfToImageView(APIView):
             )
 
         try:
-            images = convert_from_path(document.file.path, fmt="jpeg")
+            new_images = convert_pdf_to_images(document, **serializer.get_options())
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        new_images = []
-        for image in images:
-            image_io = BytesIO()
-            original_format = image.format
-            image.save(image_io, format=original_format)
-            image_io.seek(0)
-
-            image_file = SimpleUploadedFile(
-                name=f"{uuid.uuid4()}.jpg",
-                content=image_io.read(),
-                content_type="image/jpeg",
+        return Response(
+            {"images": ImageSerializer(new_images, many=True).data},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ConvertPdfToImageBatchView(APIView):
+    def post(self, request):
+        """
+        Accepts a list of PDF IDs and conversion options, converts the PDFs with
+        their pages rendered in parallel, and returns the results in request
+        order, either the page images or an error.
+        """
+        serializer = ConvertPdfToImageSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.BATCH_MAX_ITEMS,
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        items = serializer.validated_data
+        documents = Document.objects.filter(media_type="pdf").in_bulk(
+            {item["id"] for item in items}
+        )
+        converted = iter(
+            convert_pdfs_to_images(
+                [
+                    (documents[item["id"]], serializer.child.get_options(item))
+                    for item in items
+                    if item["id"] in documents
+                ]
+            )
+        )
+
+        results = []
+        for item in items:
+            if item["id"] not in documents:
+                results.append({"error": "PDF not found."})
+                continue
+            images, error = next(converted)
+            if error:
+                results.append({"error": error})
+            else:
+                results.append({"images": ImageSerializer(images, many=True).data})
+        return get_batch_response(results)
+
+
+class ConversionJobCreateView(APIView):
+    def post(self, request):
+        """
+        Accepts a PDF ID and queues its conversion to images for the conversion
+        worker. Returns the job, whose status can be polled.
+        """
+        serializer = ConvertPdfToImageSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        document_id = serializer.validated_data["id"]
+        try:
+            document = Document.objects.get(id=document_id, media_type="pdf")
+        except Document.DoesNotExist:
+            return Response(
+                {"error": "PDF not found."}, status=status.HTTP_404_NOT_FOUND
             )
 
-            new_document = Document.objects.create(
-                file=image_file,
-                media_type="image",
+        options = serializer.get_options()
+        try:
+            first_page, last_page = get_page_range(
+                document, options.get("first_page"), options.get("last_page")
             )
-            new_images.append(new_document)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        job = ConversionJob.objects.create(
+            document=document,
+            options=options,
+            pages_total=last_page - first_page + 1,
+        )
         return Response(
-            {"images": ImageSerializer(new_images, many=True).data},
-            status=status.HTTP_201_CREATED,
+            ConversionJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                "Location": reverse("conversion-job-detail", kwargs={"id": job.id})
+            },
         )
+
+
+class ConversionJobRetrieveView(RetrieveAPIView):
+    """
+    API view to retrieve the status and result of a conversion job.
+    """
+
+    queryset = ConversionJob.objects.all()
+    serializer_class = ConversionJobSerializer
+    lookup_field = "id"
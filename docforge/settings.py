@@ -55,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "docengine.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -149,3 +150,138 @@ REST_FRAMEWORK = {
 
 MEDIA_ROOT = env.str("DOCFORGE_MEDIA_ROOT", default="/var/docforge/media/")
 MEDIA_URL = "media/"
+
+# Storage of the document files: "local" for MEDIA_ROOT, or "s3" for an
+# S3-compatible object storage such as MinIO, which requires django-storages and
+# boto3. boto3 uploads files larger than 8 MiB in parallel multipart parts, and
+# downloads are redirected to presigned URLs.
+DOCFORGE_STORAGE = env.str("DOCFORGE_STORAGE", default="local")
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+if DOCFORGE_STORAGE == "s3":
+    STORAGES["default"] = {
+        "BACKEND": "storages.backends.s3.S3Storage",
+        "OPTIONS": {
+            "bucket_name": env.str("DOCFORGE_S3_BUCKET"),
+            "endpoint_url": env.str("DOCFORGE_S3_ENDPOINT_URL", default=None),
+            "access_key": env.str("DOCFORGE_S3_ACCESS_KEY", default=None),
+            "secret_key": env.str("DOCFORGE_S3_SECRET_KEY", default=None),
+            "region_name": env.str("DOCFORGE_S3_REGION", default=None),
+            "file_overwrite": False,
+            "querystring_expire": env.int("DOCFORGE_S3_URL_EXPIRE", default=3600),
+        },
+    }
+
+# Local read-through cache of the files of a remote storage that are read from
+# the disk, like the PDFs rasterized by poppler, and its maximum size in bytes.
+STORAGE_CACHE_DIR = env.str(
+    "DOCFORGE_STORAGE_CACHE_DIR", default="/var/docforge/cache/"
+)
+STORAGE_CACHE_MAX_SIZE = env.int(
+    "DOCFORGE_STORAGE_CACHE_MAX_SIZE", default=5 * 1024 * 1024 * 1024
+)
+
+# Size of the parts of remote files fetched at once when they are read.
+STORAGE_READ_BUFFER_SIZE = env.int(
+    "DOCFORGE_STORAGE_READ_BUFFER_SIZE", default=256 * 1024
+)
+
+# Size of the chunks in which binary uploads are streamed to disk.
+UPLOAD_CHUNK_SIZE = env.int("DOCFORGE_UPLOAD_CHUNK_SIZE", default=64 * 1024)
+
+# Number of threads decoding, validating and storing the files of a batch upload.
+UPLOAD_WORKERS = env.int("DOCFORGE_UPLOAD_WORKERS", default=4)
+
+# Number of conversion jobs processed at the same time by run_conversion_worker.
+CONVERSION_WORKER_CONCURRENCY = env.int(
+    "DOCFORGE_CONVERSION_WORKER_CONCURRENCY", default=2
+)
+
+# Seconds after which a running conversion job is considered abandoned by a stopped
+# worker, and queued again. Keep it above the duration of the longest conversions.
+CONVERSION_JOB_TIMEOUT = env.int("DOCFORGE_CONVERSION_JOB_TIMEOUT", default=60 * 60)
+
+# Number of PDF pages rendered at once during conversions. Each batch is written to
+# storage before the next one is rendered, which bounds the memory and disk used.
+CONVERSION_PAGE_BATCH_SIZE = env.int("DOCFORGE_CONVERSION_PAGE_BATCH_SIZE", default=1)
+
+# Number of poppler processes rendering the batches of a conversion in parallel.
+# 0 uses every CPU available to the process. Keep in mind that each conversion
+# worker runs its own renderers.
+CONVERSION_RENDER_WORKERS = env.int("DOCFORGE_CONVERSION_RENDER_WORKERS", default=0)
+
+# Maximum total size, in bytes, of the cached outputs of rotations and conversions.
+# The least recently used ones are evicted beyond it.
+DERIVATIVE_CACHE_MAX_SIZE = env.int(
+    "DOCFORGE_DERIVATIVE_CACHE_MAX_SIZE", default=10 * 1024 * 1024 * 1024
+)
+
+# Number of threads rotating the images of a batch rotation.
+ROTATION_WORKERS = env.int("DOCFORGE_ROTATION_WORKERS", default=4)
+
+# Largest number of items in a batch rotation or conversion request.
+BATCH_MAX_ITEMS = env.int("DOCFORGE_BATCH_MAX_ITEMS", default=500)
+
+# Largest width or height of the image renditions generated on demand.
+RENDITION_MAX_SIZE = env.int("DOCFORGE_RENDITION_MAX_SIZE", default=2048)
+
+# Width and height of the tiles of images and PDF pages, and resolution of the PDF
+# pages at the largest zoom level.
+TILE_SIZE = env.int("DOCFORGE_TILE_SIZE", default=256)
+TILE_MAX_DPI = env.int("DOCFORGE_TILE_MAX_DPI", default=300)
+
+# Cache of the document detail responses, local memory by default. Deleting a
+# document only clears the local memory cache of the worker process handling the
+# delete, so deployments with several workers use a shared cache, such as
+# filecache:///var/docforge/django-cache/ or redis://redis:6379/0.
+CACHES = {"default": env.cache("DOCFORGE_CACHE_URL", default="locmemcache://")}
+
+# How long document details stay in the server cache, in seconds. Local memory
+# caches are not cleared by deletes in other workers, so they only keep details for
+# a minute.
+DETAIL_CACHE_TIMEOUT = env.int(
+    "DOCFORGE_DETAIL_CACHE_TIMEOUT",
+    default=(
+        60 if CACHES["default"]["BACKEND"].endswith("LocMemCache") else 24 * 60 * 60
+    ),
+)
+
+# How long clients keep document details, in seconds.
+DETAIL_MAX_AGE = env.int("DOCFORGE_DETAIL_MAX_AGE", default=365 * 24 * 60 * 60)
+
+# Let nginx send downloaded files: views only answer with an X-Accel-Redirect header
+# pointing to the internal location below, which maps to MEDIA_ROOT. When disabled,
+# Django streams the files itself.
+USE_X_ACCEL_REDIRECT = env.bool("DOCFORGE_USE_X_ACCEL_REDIRECT", default=False)
+X_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+
+# Time the hot paths and the queries of each request, log a JSON line per request
+# and expose the timings at /metrics in the Prometheus text format.
+INSTRUMENTATION = env.bool("DOCFORGE_INSTRUMENTATION", default=False)
+
+# With instrumentation, requests sending PROFILE_TOKEN in the PROFILE_HEADER header
+# are run under cProfile, and their profile is written to PROFILE_DIR.
+PROFILE_HEADER = "X-Docforge-Profile"
+PROFILE_TOKEN = env.str("DOCFORGE_PROFILE_TOKEN", default="")
+PROFILE_DIR = env.str("DOCFORGE_PROFILE_DIR", default="/var/docforge/profiles/")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "docengine.instrumentation": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
@@ -1,12 +1,51 @@
+import asyncio
 import base64
+import json
+import logging
 import shutil
+import subprocess
+import threading
+import uuid
+from datetime import timedelta
+from io import BytesIO
 from pathlib import Path
 
 import pytest
+from asgiref.sync import iscoroutinefunction
+from django.core.cache.backends.filebased import FileBasedCache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.utils import timezone
+from pdf2image.exceptions import PDFSyntaxError
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.errors import PdfReadError
+from pypdf.generic import NameObject
 from rest_framework.test import APIClient
 
-from docengine.models import Document
+from docengine import conversion, renditions, tiles
+from docengine.conversion import (
+    convert_pdf_to_images,
+    process_next_job,
+    run_conversion_job,
+)
+from docengine.instrumentation import InstrumentationMiddleware, metrics
+from docengine.management.commands import run_conversion_worker
+from docengine.metadata import (
+    read_image_metadata,
+    read_pdf_metadata,
+    summarize_page_sizes,
+)
+from docengine.models import (
+    ConversionJob,
+    ConversionJobImage,
+    Derivative,
+    Document,
+    PendingFileDeletion,
+    get_detail_cache_key,
+)
+from docengine.storage import evict_local_cache, is_local_storage, open_stream
 
 TEST_DATA_DIR = Path(__file__).parent / "test_data"
 
@@ -127,33 +166,98 @@ def test_invalid_file_upload(api_client):
     response = api_client.post("/api/upload/", {"file": ""}, format="json")
     assert response.status_code == 400
 
+    response = api_client.post(
+        "/api/upload/", [{"file": "invalid_base64"}, {}], format="json"
+    )
+    assert response.status_code == 400
+    assert set(response.json()["error"]) == {"0", "1"}
+
+
+@pytest.fixture
+def corrupt_jpeg():
+    # The first bytes identify a JPEG image, the rest does not decode.
+    return b"\xff\xd8\xff\xe0" + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def corrupt_pdf():
+    return b"%PDF-1.4\n" + bytes(range(256)) * 4
+
+
+@pytest.mark.django_db
+def test_upload_corrupt_file(api_client, corrupt_jpeg, corrupt_pdf):
+    for content, media_type in [
+        (corrupt_jpeg, "image/jpeg"),
+        (corrupt_pdf, "application/pdf"),
+    ]:
+        encoded = base64.b64encode(content).decode()
+        response = api_client.post(
+            "/api/upload/",
+            [{"file": f"data:{media_type};base64,{encoded}"}],
+            format="json",
+        )
+        assert response.status_code == 400
+        assert "Invalid or corrupt file" in str(response.json()["error"])
+    assert Document.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_upload_partial_failure(api_client, base64_image_png, base64_pdf, settings):
+    settings.UPLOAD_WORKERS = 2
+    response = api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": "invalid_base64"}, {"file": base64_pdf}],
+        format="json",
+    )
+    assert response.status_code == 201
+    assert len(response.json()["documents"]) == 2
+    assert list(response.json()["errors"]) == ["1"]
+    assert Document.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_upload_partial_failure_corrupt_file(
+    api_client, base64_image_png, corrupt_jpeg, settings
+):
+    settings.UPLOAD_WORKERS = 2
+    encoded = base64.b64encode(corrupt_jpeg).decode()
+    response = api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": f"data:image/jpeg;base64,{encoded}"}],
+        format="json",
+    )
+    assert response.status_code == 201
+    assert len(response.json()["documents"]) == 1
+    assert list(response.json()["errors"]) == ["1"]
+    assert Document.objects.get().image_format == "PNG"
+
 
 @pytest.mark.django_db
 def test_get_all_images(api_client, image_document):
     response = api_client.get("/api/images/")
     assert response.status_code == 200
-    assert len(response.data) == 1
+    assert len(response.data["results"]) == 1
 
 
 @pytest.mark.django_db
 def test_get_all_images_empty(api_client):
     response = api_client.get("/api/images/")
     assert response.status_code == 200
-    assert len(response.data) == 0
+    assert len(response.data["results"]) == 0
 
 
 @pytest.mark.django_db
 def test_get_all_pdfs(api_client, pdf_document):
     response = api_client.get("/api/pdfs/")
     assert response.status_code == 200
-    assert len(response.data) == 1
+    assert len(response.data["results"]) == 1
 
 
 @pytest.mark.django_db
 def test_get_all_pdfs_empty(api_client):
     response = api_client.get("/api/pdfs/")
     assert response.status_code == 200
-    assert len(response.data) == 0
+    assert len(response.data["results"]) == 0
 
 
 @pytest.mark.django_db
@@ -166,6 +270,36 @@ def test_get_image_details(api_client, image_document):
     assert response.data.get("channels") == 3
 
 
+@pytest.mark.django_db
+def test_get_image_details_header_metadata(api_client, image_document):
+    response = api_client.get(f"/api/images/{image_document.id}/")
+    assert response.status_code == 200
+    assert response.data["frame_count"] == 1
+    assert response.data["orientation"] == 1
+    assert response.data["dpi"] == [72.0, 72.0]
+    assert response.data["display_width"] == 800
+    assert response.data["display_height"] == 400
+
+
+def test_read_image_metadata_frames_and_orientation():
+    with open(TEST_DATA_DIR / "test_image.webp", "rb") as file:
+        metadata = read_image_metadata(file)
+        assert not file.closed
+    assert metadata["frame_count"] == 18
+
+    image = Image.new("RGB", (80, 40))
+    exif = image.getexif()
+    exif[0x0112] = 6
+    output = BytesIO()
+    image.save(output, "JPEG", exif=exif.tobytes())
+    output.seek(0)
+    metadata = read_image_metadata(output)
+    assert metadata["orientation"] == 6
+
+    document = Document(media_type="image", **metadata)
+    assert (document.display_width, document.display_height) == (40, 80)
+
+
 @pytest.mark.django_db
 def test_get_pdf_details(api_client, pdf_document):
     response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
@@ -178,6 +312,73 @@ def test_get_pdf_details(api_client, pdf_document):
     ]
 
 
+@pytest.mark.django_db
+def test_get_pdf_details_page_dimensions_limit(api_client, pdf_document):
+    response = api_client.get(
+        f"/api/pdfs/{pdf_document.id}/", {"page_dimensions_limit": 1}
+    )
+    assert response.status_code == 200
+    assert response.data["num_pages"] == 2
+    assert response.data["page_dimensions"] == [{"height": 842, "width": 596}]
+    assert response.data["page_sizes"] == [{"width": 596, "height": 842, "count": 2}]
+
+    response = api_client.get(
+        f"/api/pdfs/{pdf_document.id}/", {"page_dimensions_limit": "-1"}
+    )
+    assert response.status_code == 400
+
+
+def test_read_pdf_metadata_inherited_mediabox():
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=200)
+    writer.add_blank_page(width=300, height=400)
+    writer.add_blank_page(width=100, height=200)
+    # Move the MediaBox of the first page to the page tree root.
+    pages = writer.root_object["/Pages"]
+    pages[NameObject("/MediaBox")] = writer.pages[0].mediabox
+    del writer.pages[0][NameObject("/MediaBox")]
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+
+    metadata = read_pdf_metadata(output)
+    assert metadata["num_pages"] == 3
+    assert metadata["page_dimensions"] == [
+        {"width": 100, "height": 200},
+        {"width": 300, "height": 400},
+        {"width": 100, "height": 200},
+    ]
+    assert summarize_page_sizes(metadata["page_dimensions"]) == [
+        {"width": 100, "height": 200, "count": 2},
+        {"width": 300, "height": 400, "count": 1},
+    ]
+
+
+def test_read_pdf_metadata_cyclic_page_tree():
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=200)
+    pages = writer.root_object["/Pages"]
+    pages["/Kids"].append(pages.indirect_reference)
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+
+    with pytest.raises(PdfReadError, match="cyclic"):
+        read_pdf_metadata(output)
+
+
+def test_read_pdf_metadata_without_mediabox():
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=200)
+    del writer.pages[0][NameObject("/MediaBox")]
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+
+    with pytest.raises(PdfReadError, match="MediaBox"):
+        read_pdf_metadata(output)
+
+
 @pytest.mark.django_db
 def test_nonexistent_image_details(api_client):
     response = api_client.get("/api/images/999/")  # invalid id
@@ -225,3 +426,1151 @@ def test_convert_pdf_to_image(api_client, pdf_document):
     )
     assert response.status_code == 201
     assert len(response.data["images"]) == 2  # two pdf pages
+
+
+@pytest.mark.django_db
+def test_metadata_extracted_on_upload(api_client, base64_image_png, base64_pdf):
+    response = api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": base64_pdf}],
+        format="json",
+    )
+    assert response.status_code == 201
+    image_id, pdf_id = response.data["documents"]
+
+    image = Document.objects.get(id=image_id)
+    assert image.width is not None
+    assert image.image_format == "PNG"
+
+    pdf = Document.objects.get(id=pdf_id)
+    assert pdf.num_pages == 2
+    assert len(pdf.page_dimensions) == 2
+
+
+@pytest.mark.django_db
+def test_get_details_does_not_read_file(api_client, image_document, pdf_document):
+    image_document.file.storage.delete(image_document.file.name)
+    pdf_document.file.storage.delete(pdf_document.file.name)
+
+    response = api_client.get(f"/api/images/{image_document.id}/")
+    assert response.status_code == 200
+    assert response.data.get("width") == 800
+    assert response.data.get("format") == "JPEG"
+
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 200
+    assert response.data["num_pages"] == 2
+
+
+@pytest.mark.django_db
+def test_backfill_metadata_command(image_document, pdf_document):
+    Document.objects.update(
+        width=None, height=None, channels=None, num_pages=None, page_dimensions=None
+    )
+    assert Document.objects.missing_metadata().count() == 2
+
+    call_command("backfill_metadata")
+
+    assert Document.objects.missing_metadata().count() == 0
+    image_document.refresh_from_db()
+    assert (image_document.width, image_document.height) == (800, 400)
+    pdf_document.refresh_from_db()
+    assert pdf_document.num_pages == 2
+
+
+@pytest.mark.django_db
+def test_backfill_metadata_command_frame_count(image_document):
+    Document.objects.update(frame_count=None)
+    assert Document.objects.missing_metadata().count() == 1
+
+    call_command("backfill_metadata")
+
+    image_document.refresh_from_db()
+    assert image_document.frame_count == 1
+
+
+@pytest.mark.django_db
+def test_stream_upload_multipart(api_client):
+    with open(TEST_DATA_DIR / "test_image.png", "rb") as image, open(
+        TEST_DATA_DIR / "test_document.pdf", "rb"
+    ) as pdf:
+        response = api_client.post(
+            "/api/upload/stream/", {"file": [image, pdf]}, format="multipart"
+        )
+    assert response.status_code == 201
+    assert len(response.data["documents"]) == 2
+    assert Document.objects.filter(media_type="image").count() == 1
+    assert Document.objects.filter(media_type="pdf").count() == 1
+
+
+@pytest.mark.django_db
+def test_stream_upload_octet_stream(api_client, settings):
+    settings.UPLOAD_CHUNK_SIZE = 1024
+    content = (TEST_DATA_DIR / "test_document.pdf").read_bytes()
+    response = api_client.post(
+        "/api/upload/stream/", content, content_type="application/octet-stream"
+    )
+    assert response.status_code == 201
+
+    document = Document.objects.get(id=response.data["documents"][0])
+    assert document.media_type == "pdf"
+    assert document.file.name.endswith(".pdf")
+    assert document.file.read() == content
+    assert document.num_pages == 2
+
+
+@pytest.mark.django_db
+def test_stream_upload_corrupt_file(api_client, settings, corrupt_pdf):
+    response = api_client.post(
+        "/api/upload/stream/", corrupt_pdf, content_type="application/octet-stream"
+    )
+    assert response.status_code == 400
+    assert "Invalid or corrupt file" in str(response.data["error"])
+
+    # The valid files of a multipart upload are not stored either.
+    with open(TEST_DATA_DIR / "test_image.png", "rb") as image:
+        response = api_client.post(
+            "/api/upload/stream/",
+            {"file": [image, SimpleUploadedFile("corrupt.pdf", corrupt_pdf)]},
+            format="multipart",
+        )
+    assert response.status_code == 400
+    assert Document.objects.count() == 0
+    assert not (settings.MEDIA_ROOT / "documents").exists()
+
+
+@pytest.mark.django_db
+def test_stream_upload_invalid(api_client):
+    response = api_client.post(
+        "/api/upload/stream/",
+        b"not a document",
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 400
+
+    response = api_client.post("/api/upload/stream/", {}, format="json")
+    assert response.status_code == 415
+    assert Document.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_create_conversion_job(api_client, pdf_document):
+    response = api_client.post(
+        "/api/convert-pdf-to-image/jobs/", {"id": pdf_document.id}, format="json"
+    )
+    assert response.status_code == 202
+    assert response.data["status"] == "queued"
+    assert response.data["pages_total"] == 2
+
+    response = api_client.get(response["Location"])
+    assert response.status_code == 200
+    assert response.data["status"] == "queued"
+    assert response.data["images"] == []
+
+
+@pytest.mark.django_db
+def test_create_conversion_job_not_found(api_client, image_document):
+    response = api_client.post(
+        "/api/convert-pdf-to-image/jobs/", {"id": image_document.id}, format="json"
+    )
+    assert response.status_code == 404
+    assert ConversionJob.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_run_conversion_job(api_client, pdf_document):
+    job = ConversionJob.objects.create(document=pdf_document)
+
+    assert process_next_job() == job
+    assert process_next_job() is None
+
+    response = api_client.get(f"/api/convert-pdf-to-image/jobs/{job.id}/")
+    assert response.data["status"] == "done"
+    assert response.data["pages_done"] == 2
+    assert len(response.data["images"]) == 2
+
+
+@pytest.mark.django_db
+def test_run_conversion_job_requeued(pdf_document, settings):
+    settings.CONVERSION_JOB_TIMEOUT = 60
+    job = ConversionJob.objects.create(document=pdf_document)
+    stopped_job = ConversionJob.claim_next()
+    assert stopped_job == job
+    # The job is still running.
+    assert ConversionJob.claim_next() is None
+
+    # The worker stopped without any progress for longer than the timeout.
+    ConversionJob.objects.filter(id=job.id).update(
+        heartbeat_at=timezone.now() - timedelta(seconds=61)
+    )
+    assert process_next_job() == job
+    job.refresh_from_db()
+    assert job.status == "done"
+    assert job.pages_done == 2
+
+    # A worker which was only slow does not record its results again.
+    run_conversion_job(stopped_job)
+    assert ConversionJobImage.objects.filter(job=job).count() == 2
+
+
+@pytest.mark.django_db
+def test_run_conversion_job_pdf_deleted(pdf_document, monkeypatch):
+    job = ConversionJob.objects.create(document=pdf_document)
+    convert = conversion.convert_pdf_to_images
+
+    def convert_and_delete(document, **kwargs):
+        images = convert(document, **kwargs)
+        Document.objects.filter(id=document.id).delete()
+        return images
+
+    monkeypatch.setattr(conversion, "convert_pdf_to_images", convert_and_delete)
+    assert process_next_job() == job
+    assert not ConversionJob.objects.exists()
+    assert not ConversionJobImage.objects.exists()
+
+
+@pytest.mark.django_db
+def test_conversion_worker_survives_errors(pdf_document, monkeypatch):
+    job = ConversionJob.objects.create(document=pdf_document)
+    results = iter([RuntimeError("database is down"), job, None])
+
+    def process_next_job():
+        result = next(results, None)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(run_conversion_worker, "process_next_job", process_next_job)
+    call_command(
+        "run_conversion_worker", "--once", "--concurrency", "2", "--poll-interval", "0"
+    )
+
+
+@pytest.mark.django_db
+def test_run_conversion_job_failed(pdf_document):
+    pdf_document.file.storage.delete(pdf_document.file.name)
+    job = ConversionJob.objects.create(document=pdf_document)
+
+    call_command("run_conversion_worker", "--once", "--concurrency", "1")
+
+    job.refresh_from_db()
+    assert job.status == "failed"
+    assert job.error
+    assert job.finished_at is not None
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_image_page_range(api_client, pdf_document):
+    response = api_client.post(
+        "/api/convert-pdf-to-image/",
+        {"id": pdf_document.id, "first_page": 2, "dpi": 72, "fmt": "png"},
+        format="json",
+    )
+    assert response.status_code == 201
+    assert len(response.data["images"]) == 1
+    assert response.data["images"][0]["format"] == "PNG"
+    assert response.data["images"][0]["width"] == 596
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_image_invalid_page_range(api_client, pdf_document):
+    response = api_client.post(
+        "/api/convert-pdf-to-image/",
+        {"id": pdf_document.id, "first_page": 2, "last_page": 1},
+        format="json",
+    )
+    assert response.status_code == 400
+
+    response = api_client.post(
+        "/api/convert-pdf-to-image/jobs/",
+        {"id": pdf_document.id, "first_page": 3},
+        format="json",
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_images_parallel(pdf_document, settings):
+    settings.CONVERSION_PAGE_BATCH_SIZE = 1
+    images = convert_pdf_to_images(pdf_document, dpi=72, workers=2)
+
+    assert len(images) == 2
+    assert Document.objects.filter(media_type="image").count() == 2
+    assert all(image.file.storage.exists(image.file.name) for image in images)
+
+
+def list_document_files(settings):
+    return sorted(
+        path.name for path in (settings.MEDIA_ROOT / "documents").rglob("*.*")
+    )
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_images_failed_batch(pdf_document, settings, monkeypatch):
+    settings.CONVERSION_PAGE_BATCH_SIZE = 1
+    stored_files = list_document_files(settings)
+    render_pages = conversion.render_pages
+    second_page_done = threading.Event()
+
+    def fail_first_page(pdf_path, first_page, last_page, **kwargs):
+        if first_page == 1:
+            second_page_done.wait(timeout=10)
+            raise RuntimeError("poppler crashed")
+        try:
+            return render_pages(pdf_path, first_page, last_page, **kwargs)
+        finally:
+            second_page_done.set()
+
+    # The pages of the batches rendered while the first one failed are deleted.
+    monkeypatch.setattr(conversion, "render_pages", fail_first_page)
+    with pytest.raises(RuntimeError):
+        convert_pdf_to_images(pdf_document, dpi=72, workers=2)
+    assert list_document_files(settings) == stored_files
+
+
+@pytest.mark.django_db
+def test_render_pages_failed_page(pdf_document, settings, monkeypatch):
+    stored_files = list_document_files(settings)
+    prepare_file = Document.prepare_file
+    prepared = []
+
+    def fail_second_page(document):
+        if prepared:
+            raise OSError("No space left on device")
+        prepare_file(document)
+        prepared.append(document)
+
+    monkeypatch.setattr(Document, "prepare_file", fail_second_page)
+    with pytest.raises(OSError):
+        conversion.render_pages(pdf_document.file.path, 1, 2, dpi=72)
+    assert len(prepared) == 1
+    assert list_document_files(settings) == stored_files
+
+
+@pytest.mark.django_db
+def test_upload_duplicate_content(api_client, base64_image_png):
+    response = api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": base64_image_png}],
+        format="json",
+    )
+    assert response.status_code == 201
+    first_id, second_id = response.data["documents"]
+    assert first_id == second_id
+
+    response = api_client.post(
+        "/api/upload/", [{"file": base64_image_png}], format="json"
+    )
+    assert response.data["documents"] == [first_id]
+
+    document = Document.objects.get()
+    assert document.ref_count == 3
+    content_hash = document.content_hash
+    assert document.file.name == (
+        f"documents/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.png"
+    )
+
+
+@pytest.mark.django_db
+def test_delete_shared_document(api_client, base64_pdf):
+    content = base64.b64decode(base64_pdf)
+    api_client.post("/api/upload/", [{"file": base64_pdf}], format="json")
+    response = api_client.post(
+        "/api/upload/stream/", content, content_type="application/octet-stream"
+    )
+    document = Document.objects.get()
+    assert response.data["documents"] == [document.id]
+    assert document.ref_count == 2
+
+    response = api_client.delete(f"/api/pdfs/{document.id}/")
+    assert response.status_code == 204
+    assert Document.objects.get().ref_count == 1
+    assert document.file.storage.exists(document.file.name)
+
+    response = api_client.delete(f"/api/pdfs/{document.id}/")
+    assert response.status_code == 204
+    assert Document.objects.count() == 0
+    # Files are deleted by the sweeper.
+    assert document.file.storage.exists(document.file.name)
+    call_command("sweep_deleted_files", "--once")
+    assert not document.file.storage.exists(document.file.name)
+
+
+@pytest.mark.django_db
+def test_rotate_image_cached(api_client, image_document):
+    data = {"id": image_document.id, "rotation_angle": 90}
+    first = api_client.post("/api/rotate/", data, format="json")
+    second = api_client.post("/api/rotate/", data, format="json")
+    assert first.status_code == second.status_code == 201
+    assert first.data["id"] == second.data["id"]
+    assert Document.objects.count() == 2
+
+    rotated = Document.objects.get(id=first.data["id"])
+    # One reference per request and one held by the derivative cache.
+    assert rotated.ref_count == 3
+
+    api_client.delete(f"/api/images/{image_document.id}/")
+    rotated.refresh_from_db()
+    assert rotated.ref_count == 2
+    assert Derivative.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_derivative_cache_eviction(api_client, image_document, settings):
+    settings.DERIVATIVE_CACHE_MAX_SIZE = 0
+    response = api_client.post(
+        "/api/rotate/", {"id": image_document.id, "rotation_angle": 90}, format="json"
+    )
+    assert response.status_code == 201
+    assert Derivative.objects.count() == 0
+    assert Document.objects.get(id=response.data["id"]).ref_count == 1
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_image_cached(api_client, pdf_document):
+    data = {"id": pdf_document.id, "dpi": 72}
+    first = api_client.post("/api/convert-pdf-to-image/", data, format="json")
+    second = api_client.post("/api/convert-pdf-to-image/", data, format="json")
+    assert first.status_code == second.status_code == 201
+    assert [image["id"] for image in first.data["images"]] == [
+        image["id"] for image in second.data["images"]
+    ]
+    assert Derivative.objects.filter(operation="convert").count() == 2
+
+
+@pytest.mark.django_db
+def test_rotate_image_exif_orientation(api_client, image_document):
+    response = api_client.post(
+        "/api/rotate/",
+        {"id": image_document.id, "rotation_angle": 90, "exif_orientation": True},
+        format="json",
+    )
+    assert response.status_code == 201
+
+    rotated = Document.objects.get(id=response.data["id"])
+    with Image.open(rotated.file) as image:
+        assert image.getexif()[0x0112] == 8
+        assert image.size == (800, 400)
+
+
+@pytest.mark.django_db
+def test_rotate_image_arbitrary_angle(api_client, image_document):
+    response = api_client.post(
+        "/api/rotate/",
+        {
+            "id": image_document.id,
+            "rotation_angle": 45,
+            "resample": "bicubic",
+            "fill_color": "white",
+        },
+        format="json",
+    )
+    assert response.status_code == 201
+    assert response.data["width"] == response.data["height"] == 850
+
+    response = api_client.post(
+        "/api/rotate/",
+        {"id": image_document.id, "rotation_angle": 45, "fill_color": "nocolor"},
+        format="json",
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_get_all_images_paginated(api_client, base64_image_png, base64_image_jpg):
+    api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": base64_image_jpg}],
+        format="json",
+    )
+    newest = Document.objects.order_by("-uploaded_at", "-id")[0]
+
+    response = api_client.get("/api/images/", {"page_size": 1})
+    assert response.status_code == 200
+    assert [doc["id"] for doc in response.data["results"]] == [str(newest.id)]
+    assert response.data["previous"] is None
+
+    response = api_client.get(response.data["next"])
+    assert len(response.data["results"]) == 1
+    assert response.data["results"][0]["id"] != str(newest.id)
+    assert response.data["next"] is None
+
+
+@pytest.mark.django_db
+def test_get_all_images_filtered(api_client, base64_image_png, base64_image_jpg):
+    api_client.post(
+        "/api/upload/",
+        [{"file": base64_image_png}, {"file": base64_image_jpg}],
+        format="json",
+    )
+
+    response = api_client.get("/api/images/", {"image_format": "png"})
+    assert len(response.data["results"]) == 1
+    response = api_client.get("/api/images/", {"image_format": "PNG"})
+    assert len(response.data["results"]) == 1
+
+    response = api_client.get("/api/images/", {"uploaded_after": "2100-01-01T00:00"})
+    assert len(response.data["results"]) == 0
+
+    response = api_client.get("/api/images/", {"uploaded_before": "2100-01-01T00:00"})
+    assert len(response.data["results"]) == 2
+
+    response = api_client.get("/api/images/", {"uploaded_before": "yesterday"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_rotate_image_batch(api_client, image_document):
+    data = [
+        {"id": image_document.id, "rotation_angle": 90},
+        {"id": uuid.uuid4(), "rotation_angle": 90},
+        {"id": image_document.id, "rotation_angle": 180},
+        {"id": image_document.id, "rotation_angle": 90},
+    ]
+    response = api_client.post("/api/rotate/batch/", data, format="json")
+    assert response.status_code == 201
+    results = response.data["results"]
+    assert results[1] == {"error": "Image not found."}
+    assert (results[0]["width"], results[0]["height"]) == (400, 800)
+    assert (results[2]["width"], results[2]["height"]) == (800, 400)
+    assert results[3]["id"] == results[0]["id"]
+
+    # Each result and the derivative cache hold a reference.
+    rotated = Document.objects.get(id=results[0]["id"])
+    assert rotated.ref_count == 3
+    assert Derivative.objects.filter(operation="rotate").count() == 2
+
+    response = api_client.post("/api/rotate/batch/", data[:1], format="json")
+    assert response.data["results"][0]["id"] == results[0]["id"]
+
+    response = api_client.post("/api/rotate/batch/", data[1:2], format="json")
+    assert response.status_code == 400
+    response = api_client.post("/api/rotate/batch/", [], format="json")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_convert_pdf_to_image_batch(api_client, pdf_document):
+    data = [
+        {"id": pdf_document.id, "dpi": 72, "last_page": 1},
+        {"id": pdf_document.id, "first_page": 5},
+        {"id": pdf_document.id, "dpi": 72},
+        {"id": pdf_document.id, "dpi": 72, "last_page": 1},
+    ]
+    response = api_client.post("/api/convert-pdf-to-image/batch/", data, format="json")
+    assert response.status_code == 201
+    results = response.data["results"]
+    assert len(results[0]["images"]) == 1
+    assert "Invalid page range" in results[1]["error"]
+    assert len(results[2]["images"]) == 2
+    assert results[3]["images"] == results[0]["images"]
+    assert Derivative.objects.filter(operation="convert").count() == 3
+
+
+@pytest.mark.django_db
+def test_bulk_delete(api_client, image_document, pdf_document, base64_image_png):
+    api_client.post("/api/upload/", [{"file": base64_image_png}], format="json")
+    assert Document.objects.count() == 3
+
+    response = api_client.post(
+        "/api/documents/delete/",
+        {"ids": [str(pdf_document.id), str(uuid.uuid4())]},
+        format="json",
+    )
+    assert response.status_code == 200
+    assert response.data == {"released": 1, "deleted": 1}
+
+    response = api_client.post(
+        "/api/documents/delete/", {"media_type": "image"}, format="json"
+    )
+    assert response.data == {"released": 2, "deleted": 2}
+    assert Document.objects.count() == 0
+
+    assert PendingFileDeletion.objects.count() == 3
+    call_command("sweep_deleted_files", "--once")
+    assert PendingFileDeletion.objects.count() == 0
+    assert not image_document.file.storage.exists(image_document.file.name)
+
+    response = api_client.post("/api/documents/delete/", {}, format="json")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_sweep_keeps_reuploaded_files(api_client, image_document):
+    content = image_document.file.read()
+    name = image_document.file.name
+    api_client.delete(f"/api/images/{image_document.id}/")
+
+    api_client.post(
+        "/api/upload/stream/", content, content_type="application/octet-stream"
+    )
+    call_command("sweep_deleted_files", "--once")
+    assert Document.objects.get().file.name == name
+    assert image_document.file.storage.exists(name)
+
+
+@pytest.mark.django_db
+def test_sweep_during_reupload(api_client, image_document):
+    content = image_document.file.read()
+    name = image_document.file.name
+    storage = image_document.file.storage
+    api_client.delete(f"/api/images/{image_document.id}/")
+    assert PendingFileDeletion.objects.filter(name=name).exists()
+
+    # The upload of the same content stores its file before the document is saved.
+    document = Document(
+        media_type="image",
+        file=SimpleUploadedFile(name="again.jpg", content=content),
+    )
+    document.prepare_file()
+    assert document.file.name == name
+
+    # The sweeper keeps the file, touched since its deletion was queued.
+    call_command("sweep_deleted_files", "--once")
+    assert not PendingFileDeletion.objects.exists()
+    assert storage.exists(name)
+
+    (document,) = Document.objects.ingest([document])
+    assert storage.exists(document.file.name)
+
+
+@pytest.mark.django_db
+def test_reconcile_media_command(image_document, settings):
+    storage = image_document.file.storage
+    orphan = storage.save("documents/orphan.png", image_document.file)
+
+    call_command("reconcile_media", "--min-age", "0", "--dry-run")
+    assert storage.exists(orphan)
+
+    call_command("reconcile_media", "--min-age", "0", "--batch-size", "1")
+    assert not storage.exists(orphan)
+    assert storage.exists(image_document.file.name)
+
+
+@pytest.mark.django_db
+def test_shard_documents_command(image_document, pdf_document):
+    storage = image_document.file.storage
+    sharded_name = image_document.file.name
+    # A file stored before the documents directory was sharded.
+    flat_name = f"documents/{Path(sharded_name).name}"
+    Path(storage.path(sharded_name)).rename(storage.path(flat_name))
+    Document.objects.filter(id=image_document.id).update(file=flat_name)
+
+    call_command("shard_documents", "--batch-size", "1", "--workers", "2")
+    image_document.refresh_from_db()
+    assert image_document.file.name == sharded_name
+    assert storage.exists(sharded_name)
+    assert not storage.exists(flat_name)
+    pdf_name = pdf_document.file.name
+    pdf_document.refresh_from_db()
+    assert pdf_document.file.name == pdf_name
+
+
+@pytest.fixture
+def remote_storage(settings, tmp_path):
+    # A storage without local paths, standing in for an object storage.
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    }
+    settings.STORAGE_CACHE_DIR = str(tmp_path / "cache")
+
+
+@pytest.mark.django_db
+def test_remote_storage(api_client, remote_storage, base64_pdf, settings):
+    response = api_client.post("/api/upload/", [{"file": base64_pdf}], format="json")
+    document = Document.objects.get(id=response.data["documents"][0])
+    assert not is_local_storage(document.file.storage)
+
+    response = api_client.post(
+        "/api/convert-pdf-to-image/", {"id": document.id, "dpi": 72}, format="json"
+    )
+    assert response.status_code == 201
+    assert len(response.data["images"]) == 2
+    # poppler read the PDF from the read-through cache.
+    cached_path = Path(settings.STORAGE_CACHE_DIR) / document.file.name
+    assert cached_path.read_bytes() == base64.b64decode(base64_pdf)
+
+    response = api_client.get(f"/api/documents/{document.id}/download/")
+    assert response.status_code == 302
+    assert response["Location"] == document.file.storage.url(document.file.name)
+
+    settings.STORAGE_CACHE_MAX_SIZE = 0
+    evict_local_cache(settings.STORAGE_CACHE_MAX_SIZE)
+    assert not cached_path.exists()
+
+
+class FakeS3Object:
+    def __init__(self, content):
+        self.content = content
+        self.content_length = len(content)
+        self.ranges = []
+
+    def get(self, Range):
+        first, last = (int(value) for value in Range[len("bytes=") :].split("-"))
+        self.ranges.append((first, last))
+        return {"Body": BytesIO(self.content[first : last + 1])}
+
+
+def test_open_stream_ranged_reads(settings):
+    settings.STORAGE_READ_BUFFER_SIZE = 256
+    content = (TEST_DATA_DIR / "test_image.png").read_bytes()
+    obj = FakeS3Object(content)
+
+    class FakeS3Storage:
+        location = "media"
+        bucket = type("Bucket", (), {"Object": lambda self, key: obj})()
+
+    with open_stream(FakeS3Storage(), "documents/image.png") as file:
+        with Image.open(file) as image:
+            assert image.size == (256, 256)
+        file.seek(0)
+        assert file.read() == content
+    assert obj.ranges[0] == (0, 255)
+
+
+# Number of queries run by each endpoint, savepoints included. The counts do not
+# depend on the number of documents or pages, which catches N+1 regressions.
+ENDPOINT_QUERIES = [
+    ("get", "/api/images/", None, 1),
+    ("get", "/api/pdfs/", None, 1),
+    ("get", "/api/images/{image.id}/", None, 1),
+    ("get", "/api/pdfs/{pdf.id}/", None, 1),
+    ("post", "/api/upload/", [{"file": "{base64_image_png}"}], 4),
+    ("post", "/api/rotate/", {"id": "{image.id}", "rotation_angle": 90}, 11),
+    ("post", "/api/convert-pdf-to-image/", {"id": "{pdf.id}", "dpi": 72}, 11),
+    ("post", "/api/convert-pdf-to-image/jobs/", {"id": "{pdf.id}"}, 2),
+    (
+        "post",
+        "/api/rotate/batch/",
+        [{"id": "{image.id}", "rotation_angle": angle} for angle in (90, 180, 270)],
+        11,
+    ),
+    (
+        "post",
+        "/api/convert-pdf-to-image/batch/",
+        [{"id": "{pdf.id}", "dpi": dpi} for dpi in (72, 96)],
+        11,
+    ),
+    ("delete", "/api/images/{image.id}/", None, 14),
+    ("delete", "/api/pdfs/{pdf.id}/", None, 14),
+    ("post", "/api/documents/delete/", {"ids": ["{image.id}", "{pdf.id}"]}, 15),
+]
+
+
+def format_request_data(data, **values):
+    if isinstance(data, str):
+        return data.format(**values)
+    if isinstance(data, list):
+        return [format_request_data(item, **values) for item in data]
+    if isinstance(data, dict):
+        return {key: format_request_data(item, **values) for key, item in data.items()}
+    return data
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("method,url,data,num_queries", ENDPOINT_QUERIES)
+def test_endpoint_query_count(
+    api_client,
+    image_document,
+    pdf_document,
+    base64_image_png,
+    django_assert_num_queries,
+    method,
+    url,
+    data,
+    num_queries,
+):
+    values = {
+        "image": image_document,
+        "pdf": pdf_document,
+        "base64_image_png": base64_image_png,
+    }
+    url = format_request_data(url, **values)
+    data = format_request_data(data, **values)
+
+    with django_assert_num_queries(num_queries):
+        response = getattr(api_client, method)(url, data, format="json")
+    assert response.status_code < 400
+
+
+@pytest.mark.django_db
+def test_image_rendition(api_client, image_document):
+    url = f"/api/images/{image_document.id}/rendition/"
+    response = api_client.get(url, {"w": 256, "fmt": "webp"})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/webp"
+    name = f"renditions/{image_document.id}/256x128.webp"
+
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as rendition:
+        assert rendition.size == (256, 128)
+        assert rendition.format == "WEBP"
+
+    # Bounds giving the same size share the same rendition.
+    etag = response["ETag"]
+    response = api_client.get(url, {"w": 300, "h": 128}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    api_client.delete(f"/api/images/{image_document.id}/")
+    call_command("sweep_deleted_files", "--once")
+    assert not image_document.file.storage.exists(name)
+
+
+@pytest.mark.django_db
+def test_image_rendition_exif_orientation(api_client):
+    image = Image.new("RGB", (800, 400))
+    exif = image.getexif()
+    exif[0x0112] = 6
+    output = BytesIO()
+    image.save(output, "JPEG", exif=exif.tobytes())
+    document = Document(
+        media_type="image",
+        file=SimpleUploadedFile(name="rotated.jpg", content=output.getvalue()),
+    )
+    document.save()
+
+    # The image is displayed rotated by 90 degrees, 400 pixels wide.
+    url = f"/api/images/{document.id}/rendition/"
+    response = api_client.get(url, {"w": 200})
+    assert response.status_code == 200
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as rendition:
+        assert rendition.size == (200, 400)
+
+
+@pytest.mark.django_db
+def test_document_download(api_client, pdf_document):
+    url = f"/api/documents/{pdf_document.id}/download/"
+    content = pdf_document.file.read()
+
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/pdf"
+    assert response["Accept-Ranges"] == "bytes"
+    assert response["ETag"] == f'"{pdf_document.content_hash}"'
+    assert b"".join(response.streaming_content) == content
+
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == 304
+
+    response = api_client.get(url, HTTP_RANGE="bytes=10-19")
+    assert response.status_code == 206
+    assert response["Content-Range"] == f"bytes 10-19/{len(content)}"
+    assert b"".join(response.streaming_content) == content[10:20]
+
+    response = api_client.get(url, HTTP_RANGE="bytes=-5")
+    assert b"".join(response.streaming_content) == content[-5:]
+
+    # A range for another version of the file gets the whole file.
+    response = api_client.get(url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"old"')
+    assert response.status_code == 200
+
+    response = api_client.get(url, HTTP_RANGE=f"bytes={len(content)}-")
+    assert response.status_code == 416
+
+    response = api_client.get(f"/api/documents/{uuid.uuid4()}/download/")
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_document_download_x_accel_redirect(api_client, image_document, settings):
+    settings.USE_X_ACCEL_REDIRECT = True
+    response = api_client.get(f"/api/documents/{image_document.id}/download/")
+    assert response.status_code == 200
+    assert response["X-Accel-Redirect"] == (
+        f"/protected-media/{image_document.file.name}"
+    )
+    assert response.content == b""
+
+
+@pytest.mark.django_db
+def test_image_rendition_invalid(api_client, image_document, pdf_document):
+    url = f"/api/images/{image_document.id}/rendition/"
+    assert api_client.get(url).status_code == 400
+    assert api_client.get(url, {"w": 0}).status_code == 400
+    assert api_client.get(url, {"w": 64, "fmt": "bmp"}).status_code == 400
+
+    response = api_client.get(f"/api/images/{pdf_document.id}/rendition/", {"w": 64})
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_async_upload_and_list(
+    api_client, base64_image_png, base64_image_jpg, base64_image_gif, base64_pdf
+):
+    response = api_client.post(
+        "/api/async/upload/",
+        [
+            {"file": base64_image_png},
+            {"file": base64_image_jpg},
+            {"file": base64_image_gif},
+            {"file": base64_pdf},
+        ],
+        format="json",
+    )
+    assert response.status_code == 201
+    assert len(response.json()["documents"]) == 4
+
+    response = api_client.post(
+        "/api/async/upload/", [{"file": "invalid_base64"}], format="json"
+    )
+    assert response.status_code == 400
+
+    ids = []
+    url = "/api/async/images/?page_size=2"
+    while url:
+        response = api_client.get(url)
+        assert response.status_code == 200
+        ids += [document["id"] for document in response.json()["results"]]
+        url = response.json()["next"]
+    expected = Document.objects.filter(media_type="image").order_by(
+        "-uploaded_at", "-id"
+    )
+    assert ids == [str(document.id) for document in expected]
+
+    response = api_client.get("/api/async/pdfs/")
+    assert len(response.json()["results"]) == 1
+    assert response.json()["next"] is None
+
+    response = api_client.get("/api/async/images/", {"image_format": "gif"})
+    assert len(response.json()["results"]) == 1
+    assert api_client.get("/api/async/images/", {"cursor": "x"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_async_retrieve_delete(api_client, image_document, pdf_document):
+    response = api_client.get(f"/api/async/images/{image_document.id}/")
+    assert response.status_code == 200
+    assert response.json()["width"] == 800
+
+    response = api_client.get(f"/api/async/pdfs/{pdf_document.id}/")
+    assert response.json()["num_pages"] == 2
+
+    response = api_client.get(f"/api/async/images/{pdf_document.id}/")
+    assert response.status_code == 404
+
+    response = api_client.delete(f"/api/async/images/{image_document.id}/")
+    assert response.status_code == 204
+    assert not Document.objects.filter(id=image_document.id).exists()
+
+
+@pytest.mark.django_db
+def test_instrumentation(api_client, base64_image_png, settings, caplog):
+    assert api_client.get("/metrics").status_code == 404
+
+    settings.INSTRUMENTATION = True
+    metrics.reset()
+    logger = logging.getLogger("docengine.instrumentation")
+    logger.addHandler(caplog.handler)
+    try:
+        response = api_client.post(
+            "/api/upload/", [{"file": base64_image_png}], format="json"
+        )
+    finally:
+        logger.removeHandler(caplog.handler)
+    assert response.status_code == 201
+
+    log = json.loads(caplog.records[-1].getMessage())
+    assert log["path"] == "/api/upload/"
+    assert log["status"] == 201
+    assert {"upload.decode", "storage.write", "db.query"} <= set(log["spans"])
+
+    response = api_client.get("/metrics")
+    assert response.status_code == 200
+    content = response.content.decode()
+    assert 'docforge_span_seconds_count{span="upload.decode"} 1' in content
+    assert 'method="POST",view="upload",status="201"' in content
+
+
+@pytest.mark.django_db
+def test_instrumentation_profile(api_client, settings, tmp_path):
+    settings.INSTRUMENTATION = True
+    settings.PROFILE_TOKEN = "secret"
+    settings.PROFILE_DIR = str(tmp_path)
+
+    response = api_client.get("/api/images/", HTTP_X_DOCFORGE_PROFILE="wrong")
+    assert "X-Profile" not in response
+
+    response = api_client.get("/api/images/", HTTP_X_DOCFORGE_PROFILE="secret")
+    assert response.status_code == 200
+    assert (tmp_path / response["X-Profile"]).exists()
+
+
+@pytest.mark.django_db
+def test_details_cached_with_etag(
+    api_client,
+    pdf_document,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert etag.startswith('"')
+    assert "immutable" in response["Cache-Control"]
+
+    with django_assert_num_queries(0):
+        response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
+        assert response.status_code == 200
+        assert response.data["num_pages"] == 2
+        assert response["ETag"] == etag
+
+        response = api_client.get(
+            f"/api/pdfs/{pdf_document.id}/", HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+    # Another media type, or query parameters, are not answered from the cache.
+    response = api_client.get(f"/api/images/{pdf_document.id}/")
+    assert response.status_code == 404
+    response = api_client.get(
+        f"/api/pdfs/{pdf_document.id}/", {"page_dimensions_limit": 1}
+    )
+    assert len(response.data["page_dimensions"]) == 1
+    assert response["ETag"] != etag
+
+    # The cached details are dropped once the delete is committed.
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.delete(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 204
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_details_cache_shared_between_workers(
+    settings, tmp_path, api_client, pdf_document, django_capture_on_commit_callbacks
+):
+    cache_dir = str(tmp_path / "django-cache")
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": cache_dir,
+        }
+    }
+    # Another worker process reads the same directory with its own cache instance.
+    other_worker_cache = FileBasedCache(cache_dir, {})
+    key = get_detail_cache_key(pdf_document.id)
+
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 200
+    assert other_worker_cache.get(key)["etag"] in response["ETag"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.delete(f"/api/pdfs/{pdf_document.id}/")
+    assert response.status_code == 204
+    assert other_worker_cache.get(key) is None
+
+
+@pytest.mark.django_db
+def test_image_tiles(api_client, image_document):
+    url = f"/api/images/{image_document.id}/tiles/"
+    response = api_client.get(url)
+    assert response.data == {"width": 800, "height": 400, "tile_size": 256, "levels": 3}
+
+    # The whole image fits in the tile of the first level.
+    response = api_client.get(f"{url}0/0/0/")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/jpeg"
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as tile:
+        assert tile.size == (200, 100)
+
+    # Tiles of the right and bottom edges are smaller.
+    response = api_client.get(f"{url}2/3/1/", {"fmt": "png"})
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as tile:
+        assert tile.size == (32, 144)
+        assert tile.format == "PNG"
+    storage = image_document.file.storage
+    assert storage.exists(f"tiles/{image_document.id}/2/3_1.png")
+
+    assert api_client.get(f"{url}2/4/0/").status_code == 404
+    assert api_client.get(f"{url}3/0/0/").status_code == 404
+
+
+@pytest.mark.django_db
+def test_pdf_page_tiles(api_client, pdf_document, settings):
+    settings.TILE_MAX_DPI = 72
+    url = f"/api/pdfs/{pdf_document.id}/pages/2/tiles/"
+    response = api_client.get(url)
+    assert response.data == {"width": 596, "height": 842, "tile_size": 256, "levels": 3}
+
+    response = api_client.get(f"{url}2/1/1/", {"fmt": "png"})
+    assert response.status_code == 200
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as tile:
+        assert tile.size == (256, 256)
+
+    response = api_client.get(f"{url}0/0/0/")
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as tile:
+        assert tile.size == (149, 211)
+
+    assert api_client.get(f"{url}2/3/0/").status_code == 404
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/pages/3/tiles/0/0/0/")
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_pdf_page_tiles_render_error(api_client, pdf_document, monkeypatch):
+    url = f"/api/pdfs/{pdf_document.id}/pages/1/tiles/0/0/0/"
+
+    def run(command, **kwargs):
+        raise subprocess.CalledProcessError(1, command, stderr=b"Syntax Error")
+
+    monkeypatch.setattr(tiles.subprocess, "run", run)
+    assert api_client.get(url).status_code == 400
+
+    # Without poppler installed.
+    monkeypatch.undo()
+    monkeypatch.setenv("PATH", "")
+    assert api_client.get(url).status_code == 400
+
+
+@pytest.mark.django_db
+def test_pdf_page_image(api_client, pdf_document):
+    url = f"/api/pdfs/{pdf_document.id}/pages/2/image/"
+    response = api_client.get(url, {"dpi": 72, "fmt": "png"})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/png"
+    with Image.open(BytesIO(b"".join(response.streaming_content))) as image:
+        assert image.size == (596, 842)
+    # Only the page is rendered, no image document is created.
+    assert Document.objects.count() == 1
+
+    name = f"pages/{pdf_document.id}/2-72.png"
+    storage = pdf_document.file.storage
+    assert storage.exists(name)
+    response = api_client.get(
+        url, {"dpi": 72, "fmt": "png"}, HTTP_IF_NONE_MATCH=response["ETag"]
+    )
+    assert response.status_code == 304
+
+    assert api_client.get(url, {"dpi": 5}).status_code == 400
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/pages/3/image/")
+    assert response.status_code == 404
+
+    api_client.delete(f"/api/pdfs/{pdf_document.id}/")
+    call_command("sweep_deleted_files", "--once")
+    assert not storage.exists(name)
+
+
+@pytest.mark.django_db
+def test_pdf_page_image_render_error(api_client, pdf_document, monkeypatch):
+    def render_page_image(*args):
+        raise PDFSyntaxError("Syntax Error: Couldn't read xref table")
+
+    monkeypatch.setattr(renditions, "render_page_image", render_page_image)
+    response = api_client.get(f"/api/pdfs/{pdf_document.id}/pages/1/image/")
+    assert response.status_code == 400
+    assert "xref" in response.data["error"]
+
+
+def test_instrumentation_middleware_async(settings, rf):
+    settings.INSTRUMENTATION = True
+
+    async def get_response(request):
+        return HttpResponse("ok")
+
+    # Async requests stay async under ASGI, instead of being run in a thread.
+    middleware = InstrumentationMiddleware(get_response)
+    assert iscoroutinefunction(middleware)
+    response = asyncio.run(middleware(rf.get("/api/async/images/")))
+    assert response.status_code == 200